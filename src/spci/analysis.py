@@ -0,0 +1,178 @@
+import os
+import mmap
+import struct
+import bisect
+import threading
+import subprocess
+import importlib.util
+from queue import Queue
+
+# Phase codes stored in the envelope cache (order matches NarrativeEngine.PHASES)
+PHASE_NAMES = ["Intro", "Build", "Peak", "Release", "Outro"]
+INTRO, BUILD, PEAK, RELEASE, OUTRO = range(5)
+
+SAMPLE_RATE = 11025     # Mono decode rate, plenty for an energy envelope
+HOP_SEC = 0.5           # One envelope value per half second
+SMOOTH_SEC = 8.0        # Window used to find sections rather than single hits
+MIN_SEGMENT_SEC = 6.0   # Shorter phases get merged into their neighbour
+PEAK_LEVEL = 0.75
+LOUD_LEVEL = 0.45
+
+# File layout: header | float32 starts[n_segments] | uint8 codes[n_segments] | uint8 energy[n_frames]
+MAGIC = b"SPCE"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")  # magic, version, hop_ms, n_frames, n_segments
+
+def numpy_available():
+    return importlib.util.find_spec("numpy") is not None
+
+def envelope_path(cache_dir, video_id):
+    return os.path.join(cache_dir, f"{video_id}.env")
+
+def decode_pcm(path, ffmpeg="ffmpeg"):
+    """Decodes a file to mono 16-bit PCM through an ffmpeg pipe."""
+    import numpy as np
+    cmd = [ffmpeg, "-v", "error", "-i", path, "-vn", "-ac", "1",
+           "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"]
+    out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    return np.frombuffer(out, dtype=np.int16)
+
+def compute_envelope(pcm):
+    """Downsampled RMS blended with a half-wave rectified onset curve, scaled to 0..1."""
+    import numpy as np
+    hop = int(SAMPLE_RATE * HOP_SEC)
+    n = len(pcm) // hop
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+
+    frames = pcm[:n * hop].reshape(n, hop).astype(np.float32) / 32768.0
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    log_e = np.log1p(rms * 100.0)
+    onset = np.maximum(np.diff(log_e, prepend=log_e[0]), 0.0)
+
+    env = 0.8 * rms / (rms.max() or 1.0) + 0.2 * onset / (onset.max() or 1.0)
+    return env.astype(np.float32)
+
+def segment_phases(env):
+    """Labels each envelope frame with a phase and run-length encodes the result."""
+    import numpy as np
+    n = len(env)
+    if n == 0:
+        return np.zeros(1, dtype=np.float32), np.array([INTRO], dtype=np.uint8)
+
+    k = max(1, min(n, int(SMOOTH_SEC / HOP_SEC)))
+    smooth = np.convolve(env, np.ones(k, dtype=np.float32) / k, mode="same")
+    smooth = (smooth - smooth.min()) / (np.ptp(smooth) or 1.0)
+
+    hot = np.flatnonzero(smooth >= PEAK_LEVEL)
+    if not len(hot):
+        raise ValueError("Track is silent")
+    loud = np.flatnonzero(smooth >= LOUD_LEVEL)
+    first_peak, last_peak = hot[0], hot[-1]
+    intro_end = min(loud[0], first_peak)
+    outro_start = max(loud[-1] + 1, last_peak + 1)
+
+    # Inside the peak span: loud sections peak, dips either build back up or release
+    rising = np.gradient(smooth) >= 0 if n > 1 else np.ones(n, dtype=bool)
+    codes = np.where(smooth >= PEAK_LEVEL, PEAK, np.where(rising, BUILD, RELEASE)).astype(np.uint8)
+    codes[:first_peak] = BUILD
+    codes[last_peak + 1:] = RELEASE
+    codes[:intro_end] = INTRO
+    codes[outro_start:] = OUTRO
+
+    change = np.flatnonzero(np.diff(codes)) + 1
+    idx = np.concatenate(([0], change))
+    starts, seg_codes = (idx * HOP_SEC).tolist(), codes[idx].tolist()
+
+    # Merge flickering short segments into the previous one (few segments, plain Python is fine)
+    merged_starts, merged_codes = [starts[0]], [seg_codes[0]]
+    ends = starts[1:] + [n * HOP_SEC]
+    for start, end, code in zip(starts[1:], ends[1:], seg_codes[1:]):
+        if end - start < MIN_SEGMENT_SEC or code == merged_codes[-1]:
+            continue
+        merged_starts.append(start)
+        merged_codes.append(code)
+    return np.array(merged_starts, dtype=np.float32), np.array(merged_codes, dtype=np.uint8)
+
+def write_envelope(dest, env, starts, codes):
+    """Writes the cache file next to its final name and renames it into place."""
+    import numpy as np
+    energy = np.clip(env * 255.0, 0, 255).astype(np.uint8)
+    tmp = dest + ".part"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, int(HOP_SEC * 1000), len(energy), len(starts)))
+        f.write(starts.astype("<f4").tobytes())
+        f.write(codes.tobytes())
+        f.write(energy.tobytes())
+    os.replace(tmp, dest)
+
+def analyze_track(video_id, path, cache_dir, ffmpeg="ffmpeg"):
+    """Worker: decode, analyze and cache one track. Returns an error string or None."""
+    try:
+        env = compute_envelope(decode_pcm(path, ffmpeg))
+        starts, codes = segment_phases(env)
+        write_envelope(envelope_path(cache_dir, video_id), env, starts, codes)
+        return None
+    except Exception as e:
+        return str(e) or type(e).__name__
+
+class Envelope:
+    """
+    Read-only, memory-mapped view of a cached envelope.
+    Needs no NumPy, so playback works even where analysis can't run.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, hop_ms, n_frames, n_segments = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError("Unsupported envelope cache")
+
+        view = memoryview(self._map)
+        offset = HEADER.size
+        self.starts = view[offset:offset + 4 * n_segments].cast("f")
+        offset += 4 * n_segments
+        self.codes = view[offset:offset + n_segments]
+        offset += n_segments
+        self.energy = view[offset:offset + n_frames]
+        self.hop = hop_ms / 1000.0
+
+    @classmethod
+    def load(cls, cache_dir, video_id):
+        """Returns the cached envelope for a track, or None when it hasn't been analyzed."""
+        path = envelope_path(cache_dir, video_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except Exception:
+            return None
+
+    def phase_at(self, pos):
+        """Binary search over segment starts: O(log n) per frame."""
+        i = bisect.bisect_right(self.starts, pos) - 1
+        return PHASE_NAMES[self.codes[max(i, 0)]]
+
+class BackgroundAnalyzer:
+    """Analyzes tracks one at a time on a daemon thread so playback never waits on it."""
+    def __init__(self, cache_dir, ffmpeg="ffmpeg"):
+        self.cache_dir = cache_dir
+        self.ffmpeg = ffmpeg
+        self._queue = Queue()
+        self._seen = set()
+        self._thread = None
+
+    def submit(self, video_id, path):
+        if video_id in self._seen or os.path.exists(envelope_path(self.cache_dir, video_id)):
+            return
+        self._seen.add(video_id)
+        self._queue.put((video_id, path))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            video_id, path = self._queue.get()
+            analyze_track(video_id, path, self.cache_dir, self.ffmpeg)
@@ -0,0 +1,55 @@
+import json
+import time
+import threading
+
+from .storage import atomic_write
+
+class BandwidthEstimator:
+    """Smoothed link throughput (kbps) from real downloads and streams, persisted between runs."""
+    ALPHA = 0.3      # Weight of the newest sample
+    HEADROOM = 0.5   # Only use half the measured link for the audio bitrate
+    PRESETS = {"low": 64, "medium": 128, "high": None}
+
+    def __init__(self, path):
+        self.path = path
+        self.kbps = 0.0
+        self.samples = 0
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.kbps, self.samples = float(data.get("kbps", 0)), int(data.get("samples", 0))
+        except (OSError, ValueError):
+            pass
+
+    def record(self, num_bytes, seconds):
+        """Adds one transfer measurement. Safe to call from download threads."""
+        if not num_bytes or not seconds or seconds <= 0:
+            return
+        sample = num_bytes * 8 / 1000 / seconds
+        with self._lock:
+            self.kbps = sample if not self.samples else self.ALPHA * sample + (1 - self.ALPHA) * self.kbps
+            self.samples += 1
+            try:
+                atomic_write(self.path, json.dumps({"kbps": round(self.kbps, 1), "samples": self.samples, "updated": int(time.time())}))
+            except OSError:
+                pass
+
+    def progress_hook(self, d):
+        """yt-dlp progress hook: measures each finished download."""
+        if d.get('status') == 'finished':
+            self.record(d.get('total_bytes') or d.get('downloaded_bytes'), d.get('elapsed'))
+
+    def select_format(self, quality="auto"):
+        """Returns (yt-dlp format string, label) for the highest audio that fits the link."""
+        if quality in self.PRESETS:
+            cap, mode = self.PRESETS[quality], quality
+        elif quality == "auto":
+            cap = int(self.kbps * self.HEADROOM) if self.kbps else None
+            mode = f"auto, link ~{int(self.kbps)} kbps" if self.kbps else "auto, unmeasured"
+        else:
+            cap, mode = int(quality), "manual"
+        if not cap:
+            return 'bestaudio/best', mode
+        # Nothing small enough? Take the lightest audio rather than the best
+        return f'bestaudio[abr<={cap}]/worstaudio/best', mode
@@ -1,5 +1,9 @@
 import yt_dlp
 import os
+from rich.console import Console
+from rich.markup import escape
+
+console = Console()
 
 class MyLogger:
     def debug(self, msg):
@@ -22,6 +26,7 @@ def get_music(query):
         'no_warnings': True,
         'extract_flat': True,
         'nocheckcertificate': True,
+        'socket_timeout': 10,
         'logger': MyLogger(),
     }
     
@@ -48,10 +53,12 @@ def get_music(query):
                         'videoId': entry.get('id'),
                         'artists': entry.get('uploader') or "Unknown",
                         'album': "YouTube",
-                        'duration': duration_str
+                        'duration': duration_str,
+                        'seconds': int(duration_sec)
                     })
     except Exception as e:
-        print(f"\n[bold red][!] Search Error:[/bold red] {e}")
+        # yt-dlp messages carry their own [brackets] and :colons:, print them literally
+        console.print(f"\n[bold red]\\[!] Search Error:[/bold red] {escape(str(e))}", emoji=False)
         
     return songs
 
@@ -0,0 +1,103 @@
+import json
+import os
+import subprocess
+
+# Target name -> (file extension, ffmpeg muxer, ffprobe codec name, encoder)
+TARGETS = {
+    "opus": ("opus", "opus", "opus", "libopus"),
+    "m4a": ("m4a", "ipod", "aac", "aac"),
+    "mp3": ("mp3", "mp3", "mp3", "libmp3lame"),
+}
+
+def probe_audio(path, ffprobe="ffprobe"):
+    """
+    Reads codec, duration, bitrate (kbps), size and tags of the first audio stream.
+    Kept free of any spci state so it can run inside a worker process.
+    """
+    cmd = [ffprobe, "-v", "quiet", "-print_format", "json",
+           "-show_format", "-show_streams", "-select_streams", "a:0", path]
+    out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    data = json.loads(out or b"{}")
+    stream = (data.get("streams") or [{}])[0]
+    fmt = data.get("format") or {}
+    tags = {k.lower(): v for k, v in (fmt.get("tags") or {}).items()}
+
+    bitrate = stream.get("bit_rate") or fmt.get("bit_rate")
+    return {
+        "codec": stream.get("codec_name"),
+        "duration": float(stream.get("duration") or fmt.get("duration") or 0),
+        "bitrate": int(bitrate) // 1000 if bitrate else 0,
+        "size": os.path.getsize(path),
+        "title": tags.get("title"),
+        "artist": tags.get("artist"),
+    }
+
+def scan_track(video_id, path, ffprobe="ffprobe"):
+    """Worker for 'library scan': probes one file and reports errors instead of raising."""
+    try:
+        return {"video_id": video_id, "path": path, "info": probe_audio(path, ffprobe), "error": None}
+    except Exception as e:
+        return {"video_id": video_id, "path": path, "info": None, "error": str(e)}
+
+def optimize_track(video_id, path, target, bitrate, ffmpeg="ffmpeg", ffprobe="ffprobe"):
+    """
+    Remuxes (stream copy) or transcodes one offline file to the target format.
+    The new file is written next to the old one and moved into place with
+    os.replace, so a crash never leaves a half-written track behind.
+    """
+    ext, muxer, codec, encoder = TARGETS[target]
+    result = {
+        "video_id": video_id,
+        "old_path": path,
+        "new_path": path,
+        "old_size": 0,
+        "new_size": 0,
+        "action": "skip",
+        "codec": None,
+        "bitrate": 0,
+        "error": None,
+    }
+    tmp_path = None
+    try:
+        info = probe_audio(path, ffprobe)
+        result["old_size"] = result["new_size"] = info["size"]
+        result["codec"], result["bitrate"] = info["codec"], info["bitrate"]
+        new_path = os.path.splitext(path)[0] + f".{ext}"
+
+        # Already in the requested codec and container: nothing to do
+        if info["codec"] == codec and new_path == path:
+            return result
+
+        if info["codec"] == codec:
+            action, codec_args = "copy", ["-c:a", "copy"]
+        else:
+            action, codec_args = "encode", ["-c:a", encoder, "-b:a", f"{bitrate}k"]
+
+        tmp_path = new_path + ".part"
+        cmd = [ffmpeg, "-y", "-v", "error", "-i", path, "-vn", "-map_metadata", "0"]
+        subprocess.run(cmd + codec_args + ["-f", muxer, tmp_path], capture_output=True, check=True)
+
+        new_size = os.path.getsize(tmp_path)
+        # A lossy re-encode that doesn't shrink the file is not worth the quality hit
+        if action == "encode" and new_size >= info["size"]:
+            return result
+
+        os.replace(tmp_path, new_path)
+        result.update(new_path=new_path, new_size=new_size, action=action, codec=codec)
+        if action == "encode":
+            result["bitrate"] = bitrate
+    except subprocess.CalledProcessError as e:
+        result["error"] = (e.stderr or b"").decode(errors="ignore").strip() or str(e)
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return result
+
+def format_bytes(num):
+    """Human readable byte count (e.g. 3.4 MB)."""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num) < 1024 or unit == "GB":
+            return f"{num:.1f} {unit}" if unit != "B" else f"{int(num)} {unit}"
+        num /= 1024
@@ -13,6 +13,8 @@ import io
 import random
 import math
 import shlex
+import urllib.parse
+import urllib.request
 from rich.console import Console
 from rich.table import Table
 from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
@@ -23,13 +25,23 @@ from rich.align import Align
 from rich import box
 from rich.text import Text
 import socket
+import threading
 import json
 import string
+import re
 from typing import List
 from rich.cells import cell_len
 # External project modules
 from .getmusic import get_music
-from tinydb import TinyDB, Query 
+from .analysis import Envelope, BackgroundAnalyzer, analyze_track, envelope_path, numpy_available
+from .visualizer import SpectrumVisualizer, get_visualizer_placeholder
+from .playqueue import PlayQueue, QueueServer, send_to_session
+from .library import TARGETS, optimize_track, probe_audio, scan_track, format_bytes
+from queue import Queue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from .storage import SharedTinyDB, FileLock, atomic_write, append_line
+from .bandwidth import BandwidthEstimator
+from tinydb import Query
 
 class MyLogger:
     def debug(self, msg):
@@ -62,8 +74,8 @@ __version__ = "2.1.6"
 
 console = Console()
 app = typer.Typer(add_completion=False)
-
-HISTORY_FILE = "play_history.txt"
+library_app = typer.Typer(add_completion=False, help="Maintain the offline library")
+app.add_typer(library_app, name="library")
 
 # --- CONFIGURATION & PATHS ---
 # Storing everything in a hidden folder in the User's home directory
@@ -71,7 +83,20 @@ APP_DIR = os.path.join(os.path.expanduser("~"), ".spci")
 BIN_DIR = os.path.join(APP_DIR, "bin")
 FAV_DIR = os.path.join(APP_DIR, "fav_audio") # Store actual .mp3 files here
 FAV_DB_PATH = os.path.join(APP_DIR, "favorites.json") # NoSQL Metadata
+ENVELOPE_DIR = os.path.join(APP_DIR, "envelopes") # Cached energy envelopes (.env)
 IPC_SOCKET = os.path.join(APP_DIR, "mpvsocket")
+QUEUE_PORT_FILE = os.path.join(APP_DIR, "queue.port") # Port of the running session's enqueue endpoint
+HISTORY_FILE = os.path.join(APP_DIR, "play_history.txt")
+HISTORY_LOCK = FileLock(HISTORY_FILE)
+LEGACY_HISTORY_FILE = "play_history.txt" # Older versions kept history in the working directory
+BANDWIDTH_PATH = os.path.join(APP_DIR, "bandwidth.json") # Measured link throughput
+STREAM_PROBE_WINDOW = 8 # Seconds of mpv cache-fill used to measure stream throughput
+STREAM_URL_TTL = 2 * 3600 # googlevideo URLs expire after a few hours; resolve again well before that
+QUICK_EXIT = 3 # A player that quits sooner than this (untouched) never really played the track
+NET_TIMEOUT = 10 # Seconds yt-dlp waits on a stalled socket
+IMPORT_BATCH_SIZE = 200 # Playlist entries per TinyDB write during import-pl
+VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+AUDIO_EXTS = ('.webm', '.m4a', '.mp3', '.opus') # Containers an offline track can end up in
 # Windows Binary Paths
 FFPLAY_PATH = os.path.join(BIN_DIR, "ffplay.exe")
 FFMPEG_PATH = os.path.join(BIN_DIR, "ffmpeg.exe")
@@ -80,9 +105,37 @@ FFPROBE_PATH = os.path.join(BIN_DIR, "ffprobe.exe")
 # Initialize directories
 os.makedirs(BIN_DIR, exist_ok=True)
 os.makedirs(FAV_DIR, exist_ok=True)
+os.makedirs(ENVELOPE_DIR, exist_ok=True)
+
+def migrate_history():
+    """Folds a history file left in the working directory by older versions into HISTORY_FILE."""
+    legacy = os.path.abspath(LEGACY_HISTORY_FILE)
+    if legacy == os.path.abspath(HISTORY_FILE) or not os.path.isfile(legacy):
+        return
+    try:
+        with HISTORY_LOCK:
+            with open(legacy, encoding="utf-8") as f:
+                old = f.read()
+            current = ""
+            if os.path.exists(HISTORY_FILE):
+                with open(HISTORY_FILE, encoding="utf-8") as f:
+                    current = f.read()
+            if old and not old.endswith("\n"):
+                old += "\n"
+            # The old entries are the older ones, so they go first
+            atomic_write(HISTORY_FILE, old + current)
+            os.remove(legacy)
+            if os.path.exists(legacy + ".lock"):
+                os.remove(legacy + ".lock")
+        console.print(f"[dim]Play history moved to {HISTORY_FILE}[/dim]")
+    except (OSError, UnicodeDecodeError):
+        pass  # Leave it where it is; we'll try again next run
+
+migrate_history()
 
 # Initialize NoSQL Database
-db = TinyDB(FAV_DB_PATH)
+# Shared with any other running spci process: locked read-modify-write, atomic renames
+db = SharedTinyDB(FAV_DB_PATH)
 fav_table = db.table('favorites')
 playlist_table = db.table('playlists')
 
@@ -156,6 +209,76 @@ class MPVController:
     def get_pos(self): return self._send_command(["get_property", "time-pos"])
     def get_duration(self): return self._send_command(["get_property", "duration"])
     def toggle_pause(self): return self._send_command(["cycle", "pause"])
+    def get_cache_speed(self): return self._send_command(["get_property", "cache-speed"])
+
+class ConnectivityMonitor:
+    """Caches whether YouTube is reachable so offline sessions fail in milliseconds, not timeouts."""
+    ONLINE_TTL = 30   # Seconds to trust a successful probe
+    OFFLINE_TTL = 5   # Re-probe sooner when offline, so reconnecting is noticed quickly
+    PROBE_TIMEOUT = 1.0    # How long a caller waits for the probe's verdict
+    CONNECT_TIMEOUT = 5.0  # How long the probe itself keeps trying
+
+    def __init__(self, host="www.youtube.com", port=443):
+        self.host = host
+        self.port = port
+        self.state = None  # None: not known yet, or the link is merely slow
+        self.checked_at = 0
+
+    def _target(self):
+        """
+        The configured HTTPS/ALL proxy if there is one, since yt-dlp sends everything
+        through it and a direct connect may be blocked; otherwise YouTube itself.
+        """
+        proxies = urllib.request.getproxies()
+        proxy = proxies.get('https') or proxies.get('all')
+        if proxy and not urllib.request.proxy_bypass(self.host):
+            parts = urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            if parts.hostname:
+                default = 1080 if parts.scheme.startswith("socks") else 8080
+                try:
+                    return parts.hostname, parts.port or default
+                except ValueError:  # Malformed port: let the real request report it
+                    pass
+        return self.host, self.port
+
+    def _probe(self, done):
+        try:
+            socket.create_connection(self._target(), timeout=self.CONNECT_TIMEOUT).close()
+            self.state = True
+        except socket.timeout:
+            self.state = None  # Slow is not down: let the real request and its own timeout decide
+        except OSError:
+            self.state = False  # DNS failure, refused or unreachable
+        self.checked_at = time.time()
+        done.set()
+
+    def is_online(self):
+        ttl = self.ONLINE_TTL if self.state else self.OFFLINE_TTL
+        if self.checked_at and time.time() - self.checked_at < ttl:
+            return self.state is not False
+
+        # Probe on a thread: a hanging DNS lookup must not stall us past PROBE_TIMEOUT.
+        # Only a definite failure counts as offline; a probe still running gets the benefit of the doubt.
+        done = threading.Event()
+        self.checked_at = time.time()
+        threading.Thread(target=self._probe, args=(done,), daemon=True).start()
+        done.wait(self.PROBE_TIMEOUT)
+        return self.state is not False
+
+    def invalidate(self):
+        """Forces a fresh probe, e.g. after a network operation failed."""
+        self.checked_at = 0
+
+net = ConnectivityMonitor()
+
+def parse_quality(value: str):
+    """Typer callback for --quality: auto, low, medium, high or a kbps cap."""
+    value = (value or "auto").lower()
+    if value in ("auto", *BandwidthEstimator.PRESETS) or (value.isdigit() and int(value) > 0):
+        return value
+    raise typer.BadParameter("use auto, low, medium, high or a bitrate in kbps")
+
+bandwidth = BandwidthEstimator(BANDWIDTH_PATH)
 
 class NarrativeEngine:
     """Maps playback state to atmospheric phases and lore."""
@@ -175,19 +298,44 @@ class NarrativeEngine:
         "Outro": ["Fade to black.", "Harmonics drifting.", "Silence approaching."]
     }
 
+    MOODS = {name: mood for _, name, mood in PHASES}
+    RELOAD_INTERVAL = 2.0 # Seconds between checks for a freshly analyzed envelope
+
     def __init__(self):
         self.cached_duration = 0
+        self.video_id = None
+        self.envelope = None
+        self._last_lookup = 0
+
+    def set_track(self, video_id):
+        """Switches to a new track and picks up its cached envelope, if any."""
+        self.video_id = video_id
+        self.cached_duration = 0
+        self.envelope = Envelope.load(ENVELOPE_DIR, video_id) if video_id else None
+        self._last_lookup = time.time()
+
+    def _phase_from_envelope(self, pos):
+        # The background analyzer may finish mid-track; look again now and then
+        if self.envelope is None and self.video_id and time.time() - self._last_lookup > self.RELOAD_INTERVAL:
+            self._last_lookup = time.time()
+            self.envelope = Envelope.load(ENVELOPE_DIR, self.video_id)
+        return self.envelope.phase_at(pos) if self.envelope else None
 
     def get_state(self, pos, duration):
         if not duration or duration <= 0: duration = self.cached_duration or 1
         self.cached_duration = duration
-        ratio = pos / duration
-        
-        phase_name, mood = "Outro", "Ethereal"
-        for threshold, name, md in self.PHASES:
-            if ratio <= threshold:
-                phase_name, mood = name, md
-                break
+
+        phase_name = self._phase_from_envelope(pos)
+        if phase_name:
+            mood = self.MOODS[phase_name]
+        else:
+            # No analysis yet: fall back to fixed position ratios
+            ratio = pos / duration
+            phase_name, mood = "Outro", "Ethereal"
+            for threshold, name, md in self.PHASES:
+                if ratio <= threshold:
+                    phase_name, mood = name, md
+                    break
         
         lore_pool = self.LORE_LINES.get(phase_name, ["..."])
         lore = lore_pool[int(pos // 6) % len(lore_pool)]
@@ -206,6 +354,11 @@ def make_layout() -> Layout:
         Layout(name="left", ratio=3),
         Layout(name="right", ratio=1),
     )
+    # Spectrum panel stays hidden until the visualizer is switched on
+    layout["left"].split_column(
+        Layout(name="now", ratio=1),
+        Layout(name="viz", size=10, visible=False),
+    )
     return layout
 
 def get_header():
@@ -215,13 +368,13 @@ def get_header():
         style="white on black"
     )
     
-def get_now_playing_panel(title, artist, is_offline, pos, duration):
+def get_now_playing_panel(title, artist, is_offline, pos, duration, engine=None, fmt=""):
     # 1. Natural Transliteration
     safe_title = sanitize_text(title)
     safe_artist = sanitize_text(artist)
     
-    # 2. Logic for Narrative Engine
-    engine = NarrativeEngine()
+    # 2. Logic for Narrative Engine (reuse the session engine so its caches survive)
+    engine = engine or NarrativeEngine()
     phase, mood, lore = engine.get_state(pos, duration)
     
     # 3. Visual Safety Truncation
@@ -245,6 +398,8 @@ def get_now_playing_panel(title, artist, is_offline, pos, duration):
     grid.add_row("ARTIST", f"[cyan]{safe_artist}[/cyan]")
     grid.add_row("PHASE", f"[bold magenta]{phase}[/bold magenta] [dim]({mood})[/dim]")
     grid.add_row("LORE", f"[italic green]“{lore}”[/italic green]")
+    if fmt:
+        grid.add_row("QUALITY", f"[white]{fmt}[/white]")
     grid.add_row("", "")
     grid.add_row("[white]PROGRESS[/white]", f"{bar} [bold cyan]{time_str}[/bold cyan]")
 
@@ -257,19 +412,28 @@ def get_now_playing_panel(title, artist, is_offline, pos, duration):
         expand=True
     )
 
-def get_controls_panel(repeat_mode: bool = False):
+def get_controls_panel(repeat_mode: bool = False, shuffle_mode: bool = False, queued: int = 0):
     status = "[bold green]ON[/bold green]" if repeat_mode else "[bold red]OFF[/bold red]"
+    shuffle = "[bold green]ON[/bold green]" if shuffle_mode else "[bold red]OFF[/bold red]"
     return Panel(
-        Align.center(f"[bold white]ACTIVE SESSION[/bold white] | REPEAT: {status}\n[dim]Ctrl+C: Stop | Ctrl+R: Repeat | Ctrl+P: Pause | n: Next[/dim]"),
+        Align.center(f"[bold white]ACTIVE SESSION[/bold white] | REPEAT: {status} | SHUFFLE: {shuffle} | QUEUE: {queued}\n[dim]Ctrl+C: Stop | Ctrl+R: Repeat | Ctrl+P: Pause | n: Next | p: Prev | s: Shuffle | a: Add | v: Visualizer[/dim]"),
         title="Controls",
         border_style="blue"
     )
 
-def get_stats_panel():
-    """Sidebar showing database status and history."""
+def get_stats_panel(up_next=None):
+    """Sidebar showing database status, the next queued songs and history."""
     try:
         fav_count = len(fav_table.all())
         content = f"[bold green]Offline Songs: {fav_count}[/bold green]\n\n"
+        if up_next:
+            content += "[bold white]Up Next:[/bold white]\n"
+            for entry in up_next:
+                label = (entry.get('title') or entry.get('query')) if isinstance(entry, dict) else entry
+                text_obj = Text(f"» {sanitize_text(label)}", style="dim")
+                text_obj.truncate(22, overflow="ellipsis")
+                content += f"{text_obj}\n"
+            content += "\n"
         content += "[bold white]Recent Activity:[/bold white]\n"
         
         if os.path.exists(HISTORY_FILE):
@@ -323,6 +487,14 @@ def auto_install_dependencies(system):
     except subprocess.CalledProcessError as e:
         console.print(f"[bold red]Installation failed:[/bold red] {e}")
 
+def get_ffmpeg_tools():
+    """Returns (ffmpeg, ffprobe) paths. Uses local Trinity on Windows, system binaries elsewhere."""
+    if platform.system() == "Windows":
+        if not all(os.path.exists(p) for p in [FFMPEG_PATH, FFPROBE_PATH]):
+            download_trinity_windows([])
+        return FFMPEG_PATH, FFPROBE_PATH
+    return shutil.which("ffmpeg"), shutil.which("ffprobe")
+
 def get_player_command():
     """Checks for binaries. Uses local Trinity on Windows, system mpv on Linux/Mac."""
     system = platform.system()
@@ -381,8 +553,8 @@ def download_trinity_windows(flags):
 
 def log_history(name, video_id):
     safe_name = sanitize_text(name)
-    with open(HISTORY_FILE, "a", encoding="utf-8") as f:
-        f.write(f"{safe_name} | {video_id}\n")
+    # Locked single-line append; the stats panel reads without locking
+    append_line(HISTORY_FILE, f"{safe_name} | {video_id}\n", HISTORY_LOCK)
 
 # --- SHELL LOGIC ---
 
@@ -420,55 +592,113 @@ def shell():
 def setup():
     subprocess.run(["pip", "install", "-e", "."], check=True) 
 
-@app.command(short_help="Add song to storage (Raw format for mpv)")
-def add_fav(video_id: str):
-    """Downloads raw audio without needing ffmpeg conversion on Linux/Mac."""
-    system = platform.system()
+def download_audio(video_id: str, native: bool = True, quality: str = "auto", progress_hook=None):
+    """
+    Downloads one track into FAV_DIR and returns its favorites record.
+    Does not touch TinyDB, so several downloads can run in threads.
+    'progress_hook' replaces the bandwidth measurement, for callers that measure themselves.
+    """
     url = f"https://www.youtube.com/watch?v={video_id}"
     
-    # On Windows, we still use our local ffmpeg to make .mp3s
-    # On Linux/Mac, we download the raw file to avoid ffmpeg dependencies
-    if system == "Windows":
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': os.path.join(FAV_DIR, video_id),
-            'ffmpeg_location': BIN_DIR,
-            'postprocessors': [{'key': 'FFmpegExtractAudio',
-                                'preferredcodec': 'mp3',
-                                'preferredquality': '64'}],
-            'logger': MyLogger(),
-            'no_warnings': True,
-        }
-    else:
-        # NO POST-PROCESSING: Just get the raw audio file (usually .webm or .m4a)
-        ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': os.path.join(FAV_DIR, video_id),
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '64', # This ensures the file size remains small
-        }],
+    ydl_opts = {
+        'format': bandwidth.select_format(quality)[0],
+        'outtmpl': os.path.join(FAV_DIR, f"{video_id}.%(ext)s"),
+        'progress_hooks': [progress_hook or bandwidth.progress_hook],
         'quiet': True,
+        'socket_timeout': NET_TIMEOUT,
         'logger': MyLogger(),
         'no_warnings': True,
     }
+    # On Windows, ffmpeg lives in our local bin folder
+    if platform.system() == "Windows":
+        ydl_opts['ffmpeg_location'] = BIN_DIR
+
+    # NATIVE: Keep the raw audio file (usually .webm or .m4a), no second lossy encode.
+    # Use 'spci library optimize' later to remux/compress the whole library in parallel.
+    if not native:
+        ydl_opts['postprocessors'] = [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '64', # This ensures the file size remains small
+        }]
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=True)
+    # The top-level 'ext' is the source format's; only the download entry knows the post-processed file
+    downloads = info.get('requested_downloads') or [{}]
+    path = downloads[0].get('filepath') or os.path.join(FAV_DIR, f"{video_id}.{info.get('ext', 'mp3')}")
+
+    # Cache stream details now so playback never has to ask the player for them
+    record = {
+        'video_id': video_id,
+        'title': info.get('title'),
+        'artist': info.get('uploader'),
+        'path': path,
+        'duration': float(info.get('duration') or 0),
+        'codec': info.get('acodec') if native else 'mp3',
+        'bitrate': int(info.get('abr') or 0) if native else 64,
+        'size': os.path.getsize(path) if os.path.exists(path) else 0,
+    }
+    ffprobe = FFPROBE_PATH if platform.system() == "Windows" else shutil.which("ffprobe")
+    if (not record['duration'] or not record['bitrate']) and ffprobe and os.path.exists(path):
+        try:
+            probed = probe_audio(path, ffprobe)
+            record.update({k: probed[k] for k in ('duration', 'codec', 'bitrate', 'size')})
+        except Exception:
+            pass  # Metadata is best effort; 'spci library scan' can fill it in later
+    return record
+
+def download_many(video_ids: List[str], workers: int = 4, native: bool = True, quality: str = "auto"):
+    """Downloads several tracks in parallel, skipping ones already saved offline."""
+    Song = Query()
+    pending = [v for v in dict.fromkeys(video_ids) if not fav_table.contains(Song.video_id == v)]
+    if not pending:
+        return console.print("[dim]All tracks are already available offline.[/dim]")
+    if not net.is_online():
+        return console.print("[bold red]Download Error:[/bold red] You are offline.")
+
+    # Parallel transfers share the link, so one file's rate says little about it;
+    # measure the whole batch instead (list.append is safe across the worker threads)
+    finished_bytes = []
+    def count_bytes(d):
+        if d.get('status') == 'finished':
+            finished_bytes.append(d.get('total_bytes') or d.get('downloaded_bytes') or 0)
+
+    failed = 0
+    started = time.time()
+    with Progress(SpinnerColumn(), TextColumn("[green]Downloading..."), BarColumn(), TextColumn("{task.completed}/{task.total}"), console=console) as progress:
+        task = progress.add_task("Downloading", total=len(pending))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(download_audio, v, native, quality, count_bytes): v for v in pending}
+            for future in as_completed(futures):
+                progress.update(task, advance=1)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    failed += 1
+                    progress.console.print(f"[bold red]Download Error:[/bold red] {futures[future]} [dim]{str(e)[:80]}[/dim]")
+                    continue
+                fav_table.upsert(record, Song.video_id == record['video_id'])
+    bandwidth.record(sum(finished_bytes), time.time() - started)
+
+    console.print(f"[bold green]Saved {len(pending) - failed} track(s) offline.[/bold green]"
+                  + (f" [bold red]{failed} failed.[/bold red]" if failed else ""))
 
+@app.command(short_help="Add song to storage (Raw format for mpv)")
+def add_fav(
+    video_id: str,
+    native: bool = typer.Option(True, "--native/--mp3", help="Keep the downloaded container or transcode to 64k mp3"),
+    quality: str = typer.Option("auto", "--quality", "-q", callback=parse_quality, help="auto, low, medium, high or a kbps cap"),
+):
+    """Downloads raw audio; only runs ffmpeg when an mp3 copy is requested."""
+    if not net.is_online():
+        return console.print("[bold red]Download Error:[/bold red] You are offline.")
     with console.status(f"[bold green]Downloading '{video_id}'...[/bold green]"):
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                # Find exactly what file was saved
-                ext = info.get('ext', 'mp3') if system == "Windows" else info['ext']
-                final_path = os.path.join(FAV_DIR, f"{video_id}.{ext}")
-
-                fav_table.upsert({
-                    'video_id': video_id,
-                    'title': info.get('title'),
-                    'artist': info.get('uploader'),
-                    'path': final_path
-                }, Query().video_id == video_id)
-            console.print(f"[bold green]Success![/bold green] Saved as {info['ext']} for mpv playback.")
+            record = download_audio(video_id, native, quality)
+            fav_table.upsert(record, Query().video_id == video_id)
+            ext = os.path.splitext(record['path'])[1].lstrip('.')
+            console.print(f"[bold green]Success![/bold green] Saved as {ext} for offline playback.")
         except Exception as e:
             console.print(f"[bold red]Download Error:[/bold red] {e}")
 
@@ -485,9 +715,12 @@ def show_fav():
     table.add_column("Song Title", style="bold white")
     table.add_column("Artist", style="cyan")
     table.add_column("Video ID", style="green")
+    table.add_column("Time", justify="right")
+    table.add_column("Format", style="dim")
     
     for i, song in enumerate(favs, start=1):
-        table.add_row(str(i), song['title'], song['artist'], song['video_id'])
+        fmt = f"{song['codec']} {song.get('bitrate') or '?'}k" if song.get('codec') else "?"
+        table.add_row(str(i), song['title'], song['artist'], song['video_id'], format_duration(song.get('duration')), fmt)
     
     console.print(table, justify="center")
     
@@ -509,14 +742,20 @@ def help():
     "play <VideoID> [bold yellow](offline)[/bold yellow]\n[dim]or[/dim]\n\"song name\" [bold yellow](online)[/bold yellow]", 
     "Play a song from local storage or search and stream online."
 )
-    table.add_row("add-fav \"<VideoID>\"", "Add to favorites")
+    table.add_row("add-fav \"<VideoID>\" [--mp3]", "Add to favorites")
     table.add_row("show-fav", "Show offline favorites")
     table.add_row("delete-fav \"<VideoID>\"", "Remove from favorites")
+    table.add_row("enqueue <songs...>", "Queue songs in the running player")
     table.add_row("add-pl <IDs...>", "Create a playlist")
     table.add_row("del-pl <ID/Name>", "Delete a playlist")
     table.add_row("play-pl <ID/Name>", "Play a playlist")
+    table.add_row("import-pl <URL> [--download]", "Import a YouTube playlist")
+    table.add_row("refresh-pl <ID/Name>", "Re-resolve playlist song details")
     table.add_row("view-pl", "View all playlists")
     table.add_row("find-pl <ID/Name>", "Find a playlist")
+    table.add_row("library optimize [--target opus]", "Compress offline files in parallel")
+    table.add_row("library scan [--prune]", "Backfill track details, sync with disk")
+    table.add_row("library analyze", "Map track energy for the Narrative Engine")
     table.add_row("show-history", "Show playback history")
     table.add_row("clear-history", "Clear playback history")
     table.add_row("quit / exit", "Exit the interactive shell")
@@ -550,6 +789,15 @@ def help():
 @app.command(short_help="Find music online")
 def search(query: str):
     """Searches Online and displays results with Natural Hinglish transliteration."""
+    if not net.is_online():
+        console.print("[bold yellow]Offline:[/bold yellow] YouTube is unreachable, showing offline matches.")
+        match = match_local(query)
+        if match:
+            console.print(f"[green]{match['video_id']}[/green]  [bold white]{sanitize_text(match['title'])}[/bold white] [cyan]{sanitize_text(match['artist'])}[/cyan]")
+        else:
+            console.print("[bold red]No results found.[/bold red]")
+        return
+
     with console.status(f"[bold green]Searching for '{query}'...[/bold green]"):
         results = get_music(query)
    
@@ -578,17 +826,182 @@ def search(query: str):
     else:
         console.print("[bold red]No results found.[/bold red]")
 
+def format_duration(seconds):
+    """Formats seconds as m:ss (or h:mm:ss for long runs)."""
+    seconds = int(seconds or 0)
+    h, rem = divmod(seconds, 3600)
+    m, sec = divmod(rem, 60)
+    return f"{h}:{m:02d}:{sec:02d}" if h else f"{m}:{sec:02d}"
+
+def lookup_fav_entry(query: str):
+    """Returns a playlist entry built from offline metadata, or None."""
+    Song = Query()
+    fav = fav_table.get((Song.video_id == query) | (Song.title == query))
+    if not fav:
+        return None
+    return {
+        "query": query,
+        "video_id": fav['video_id'],
+        "title": fav.get('title'),
+        "artist": fav.get('artist'),
+        "duration": int(fav.get('duration') or 0)
+    }
+
+def resolve_metadata(query: str):
+    """Resolves one playlist entry online. Never touches TinyDB, so it is safe to run in threads."""
+    opts = {'quiet': True, 'logger': MyLogger(), 'no_warnings': True, 'socket_timeout': NET_TIMEOUT}
+    if VIDEO_ID_RE.match(query):
+        try:
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                # process=False: metadata only, skip format selection
+                info = ydl.extract_info(f"https://www.youtube.com/watch?v={query}", download=False, process=False)
+            return {
+                "query": query,
+                "video_id": info.get('id', query),
+                "title": info.get('title'),
+                "artist": info.get('uploader') or "Unknown",
+                "duration": int(info.get('duration') or 0)
+            }
+        except Exception:
+            # Deleted, private or a network error: searching the ID string would pick an unrelated song
+            return {"query": query}
+
+    results = get_music(query)
+    if not results:
+        return {"query": query}
+    song = results[0]
+    return {
+        "query": query,
+        "video_id": song['videoId'],
+        "title": song['title'],
+        "artist": song['artists'],
+        "duration": int(song.get('seconds') or 0)
+    }
+
+def resolve_entries(queries: List[str]):
+    """Resolves playlist entries once: offline hits first, the rest concurrently online."""
+    entries = [lookup_fav_entry(q) for q in queries]
+    missing = [i for i, e in enumerate(entries) if e is None]
+
+    if missing and not net.is_online():
+        # Keep them unresolved; 'refresh-pl' fills them in once back online
+        for i in missing:
+            entries[i] = {"query": queries[i]}
+        return entries
+
+    if missing:
+        with console.status(f"[bold green]Resolving {len(missing)} song(s)...[/bold green]"):
+            with ThreadPoolExecutor(max_workers=min(8, len(missing))) as pool:
+                for i, entry in zip(missing, pool.map(resolve_metadata, [queries[i] for i in missing])):
+                    entries[i] = entry
+    return entries
+
+def playlist_entries(pl):
+    """Normalizes stored songs; playlists saved before metadata resolution hold plain strings."""
+    return [{"query": s} if isinstance(s, str) else s for s in pl.get('songs', [])]
+
 @app.command(name="add-pl", short_help="Add a new playlist")
 def add_pl(song_ids: List[str]):
     """Creates a new playlist with the given song IDs."""
     playlist_name = typer.prompt("Enter playlist name")
     playlist_id = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+    songs = resolve_entries(song_ids)
     playlist_table.insert({
         "id": playlist_id,
         "name": playlist_name,
-        "songs": song_ids
+        "songs": songs
     })
     console.print(f"[bold green]Playlist '{playlist_name}' created with ID: {playlist_id}[/bold green]")
+    unresolved = [s['query'] for s in songs if not s.get('video_id')]
+    if unresolved:
+        console.print(f"[yellow]Could not resolve: {', '.join(unresolved)} (will search at play time)[/yellow]")
+
+@app.command(name="import-pl", short_help="Import a YouTube/YouTube Music playlist")
+def import_pl(
+    url: str,
+    name: str = typer.Option(None, "--name", "-n", help="Playlist name (defaults to the source title)"),
+    download: bool = typer.Option(False, "--download", "-d", help="Also save every track for offline playback"),
+    workers: int = typer.Option(4, "--workers", "-w", help="Parallel downloads"),
+    quality: str = typer.Option("auto", "--quality", "-q", callback=parse_quality, help="Download quality: auto, low, medium, high or a kbps cap"),
+):
+    """Streams playlist entries with flat extraction (no per-video requests) into the store in batches."""
+    if not net.is_online():
+        return console.print("[bold red]Import Error:[/bold red] You are offline.")
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'socket_timeout': NET_TIMEOUT,
+        'logger': MyLogger(),
+    }
+    playlist_id = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+    Playlist = Query()
+    songs, batch = [], []
+
+    def flush():
+        songs.extend(batch)
+        batch.clear()
+        playlist_table.update({"songs": songs}, Playlist.id == playlist_id)
+
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # process=False keeps 'entries' as a lazy generator, so pages arrive as we iterate
+            result = ydl.extract_info(url, download=False, process=False)
+            while result.get('_type') == 'url':
+                result = ydl.extract_info(result['url'], download=False, process=False)
+            if 'entries' not in result:
+                return console.print("[bold red]Error:[/bold red] URL is not a playlist.")
+
+            playlist_name = name or result.get('title') or playlist_id
+            playlist_table.insert({"id": playlist_id, "name": playlist_name, "songs": [], "source": url})
+
+            with console.status(f"[bold green]Importing '{playlist_name}'...[/bold green]") as status:
+                for entry in result['entries']:
+                    if not entry or not entry.get('id'):
+                        continue
+                    batch.append({
+                        "query": entry['id'],
+                        "video_id": entry['id'],
+                        "title": entry.get('title'),
+                        "artist": entry.get('uploader') or entry.get('channel') or "Unknown",
+                        "duration": int(entry.get('duration') or 0)
+                    })
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        flush()
+                        status.update(f"[bold green]Importing '{playlist_name}'... {len(songs)} tracks[/bold green]")
+                flush()
+    except Exception as e:
+        console.print(f"[bold red]Import Error:[/bold red] {e}")
+        if not songs and not batch:
+            playlist_table.remove(Playlist.id == playlist_id)
+            return
+        flush() # Keep whatever was fetched before the failure
+
+    console.print(f"[bold green]Playlist '{playlist_name}' imported with ID: {playlist_id}[/bold green] "
+                  f"({len(songs)} tracks, {format_duration(sum(s['duration'] for s in songs))})")
+    if download and songs:
+        download_many([s['video_id'] for s in songs], workers, quality=quality)
+
+@app.command(name="refresh-pl", short_help="Re-resolve playlist metadata")
+def refresh_pl(identifier: str):
+    """Resolves every entry of a playlist again and stores ID, title, artist and duration."""
+    Playlist = Query()
+    cond = (Playlist.id == identifier) | (Playlist.name == identifier)
+    pl = playlist_table.get(cond)
+    if not pl:
+        return console.print(f"[bold red]Playlist not found.[/bold red]")
+
+    if not net.is_online():
+        return console.print("[bold red]Refresh Error:[/bold red] You are offline.")
+
+    old = playlist_entries(pl)
+    fresh = resolve_entries([s.get('query') or s.get('video_id') for s in old])
+    # An entry that couldn't be re-resolved keeps what we already knew about it
+    songs = [new if new.get('video_id') or not prev.get('video_id') else prev for prev, new in zip(old, fresh)]
+    playlist_table.update({"songs": songs}, cond)
+    resolved = sum(1 for s in songs if s.get('video_id'))
+    console.print(f"[bold green]Playlist '{pl['name']}' refreshed:[/bold green] {resolved}/{len(songs)} resolved, "
+                  f"total {format_duration(sum(s.get('duration') or 0 for s in songs))}")
 
 @app.command(name="del-pl", short_help="Delete a playlist")
 def del_pl(identifier: str):
@@ -611,9 +1024,12 @@ def view_pl():
     table.add_column("ID", style="cyan")
     table.add_column("Name", style="green")
     table.add_column("Songs", style="magenta")
+    table.add_column("Length", justify="right")
     
     for pl in playlists:
-        table.add_row(pl['id'], pl['name'], str(len(pl['songs'])))
+        songs = playlist_entries(pl)
+        total = sum(s.get('duration') or 0 for s in songs)
+        table.add_row(pl['id'], pl['name'], str(len(songs)), format_duration(total) if total else "[dim]?[/dim]")
     
     console.print(table)
 
@@ -622,15 +1038,71 @@ def find_pl(identifier: str):
     """Shows details of a specific playlist."""
     Playlist = Query()
     pl = playlist_table.get((Playlist.id == identifier) | (Playlist.name == identifier))
-    if pl:
-        console.print(f"[bold cyan]ID:[/bold cyan] {pl['id']}")
-        console.print(f"[bold green]Name:[/bold green] {pl['name']}")
-        console.print(f"[bold magenta]Songs:[/bold magenta] {', '.join(pl['songs'])}")
-    else:
-        console.print(f"[bold red]Playlist not found.[/bold red]")
+    if not pl:
+        return console.print(f"[bold red]Playlist not found.[/bold red]")
+
+    songs = playlist_entries(pl)
+    console.print(f"[bold cyan]ID:[/bold cyan] {pl['id']}")
+    console.print(f"[bold green]Name:[/bold green] {pl['name']}")
+    console.print(f"[bold magenta]Length:[/bold magenta] {format_duration(sum(s.get('duration') or 0 for s in songs))}")
+
+    table = Table(box=box.SIMPLE)
+    table.add_column("No.", style="dim")
+    table.add_column("Title", style="bold white")
+    table.add_column("Artist", style="cyan")
+    table.add_column("Video ID", style="green")
+    table.add_column("Time", justify="right")
+    for i, s in enumerate(songs, start=1):
+        if s.get('video_id'):
+            table.add_row(str(i), sanitize_text(s.get('title')), sanitize_text(s.get('artist')), s['video_id'], format_duration(s.get('duration')))
+        else:
+            table.add_row(str(i), f"[dim]{s['query']}[/dim]", "[dim]unresolved[/dim]", "", "")
+    console.print(table)
+
+def local_source(entry):
+    """Returns the audio file of a favorites record, trying the usual extensions."""
+    base_path = os.path.splitext(entry['path'])[0]
+    candidates = [entry['path']] + [base_path + ext for ext in AUDIO_EXTS]
+    return next((p for p in candidates if os.path.exists(p)), None)
+
+def remove_envelope(video_id: str):
+    """Deletes a track's cached envelope. A player may still have it mapped (Windows refuses then)."""
+    env_path = envelope_path(ENVELOPE_DIR, video_id)
+    try:
+        if os.path.exists(env_path):
+            os.remove(env_path)
+    except OSError as e:
+        console.print(f"[bold yellow]Warning:[/bold yellow] Could not delete envelope cache: {e}")
+
+def match_local(query: str):
+    """Best offline match for free text: title substring first, then every word in title/artist."""
+    q = query.casefold()
+    words = q.split()
+    fallback = None
+    for song in fav_table.all():
+        title = (song.get('title') or '').casefold()
+        if q in title:
+            return song
+        if fallback is None and words and all(w in f"{title} {(song.get('artist') or '').casefold()}" for w in words):
+            fallback = song
+    return fallback
+
+def describe_format(codec, kbps, mode):
+    """Short label for the now-playing panel, e.g. 'opus 70k (auto, link ~900 kbps)'."""
+    codec = codec or "audio"
+    rate = f" {int(kbps)}k" if kbps else ""
+    return f"{codec}{rate} ({mode})"
+
+def resolve_audio(query, quality: str = "auto"):
+    """
+    Resolves a query (ID or Title) to a playable audio source and metadata.
+    Accepts a pre-resolved playlist entry (dict) to skip the online search.
+    Streams use the highest format that fits the measured bandwidth unless 'quality' overrides it.
+    """
+    known = query if isinstance(query, dict) and query.get('video_id') else None
+    if isinstance(query, dict):
+        query = query.get('video_id') or query['query']
 
-def resolve_audio(query: str):
-    """Resolves a query (ID or Title) to a playable audio source and metadata."""
     Song = Query()
     offline_entry = fav_table.get((Song.video_id == query) | (Song.title == query))
 
@@ -640,45 +1112,62 @@ def resolve_audio(query: str):
     audio_source = None
     is_offline = False
     duration = 0
+    fmt_label = ""
+
+    # No network: go straight to the local library instead of waiting on timeouts
+    if offline_entry is None and not known and not net.is_online():
+        offline_entry = match_local(query)
 
     if offline_entry:
-        base_path = os.path.splitext(offline_entry['path'])[0]
-        for ext in ['.webm', '.m4a', '.mp3', '.opus']:
-            test_path = base_path + ext
-            if os.path.exists(test_path):
-                audio_source = test_path
-                title = offline_entry.get('title', 'Unknown')
-                artist = offline_entry.get('artist', 'Unknown')
-                vid = offline_entry.get('video_id', query)
-                is_offline = True
-                break
+        audio_source = local_source(offline_entry)
+        if audio_source:
+            title = offline_entry.get('title', 'Unknown')
+            artist = offline_entry.get('artist', 'Unknown')
+            vid = offline_entry.get('video_id', query)
+            duration = offline_entry.get('duration') or 0
+            fmt_label = describe_format(offline_entry.get('codec'), offline_entry.get('bitrate'), "offline")
+            is_offline = True
 
     if not is_offline:
+        if not net.is_online():
+            return None
         try:
             with console.status(f"[bold green]Searching online for '{query}'...[/bold green]"):
-                results = get_music(query)
-                if not results:
-                    return None
-                
-                song = results[0]
-                vid, title, artist = song['videoId'], song['title'], song['artists']
+                if known:
+                    vid = known['video_id']
+                    title = known.get('title') or title
+                    artist = known.get('artist') or artist
+                    duration = known.get('duration') or 0
+                else:
+                    results = get_music(query)
+                    if not results:
+                        return None
+
+                    song = results[0]
+                    vid, title, artist = song['videoId'], song['title'], song['artists']
                 
                 second_check = fav_table.get(Song.video_id == vid)
                 if second_check and os.path.exists(second_check['path']):
                     audio_source, is_offline = second_check['path'], True
+                    duration = second_check.get('duration') or duration
+                    fmt_label = describe_format(second_check.get('codec'), second_check.get('bitrate'), "offline")
                 else:
+                    fmt, mode = bandwidth.select_format(quality)
                     ydl_opts = {
-                        'format': 'bestaudio/best', 
+                        'format': fmt,
                         'quiet': True,
                         'logger': MyLogger(),
                         'no_warnings': True,
+                        'socket_timeout': NET_TIMEOUT,
                     }
                     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                         info = ydl.extract_info(f"https://www.youtube.com/watch?v={vid}", download=False)
                         audio_source = info.get('url')
                         duration = info.get('duration', 0)
+                        fmt_label = describe_format(info.get('acodec'), info.get('abr'), mode)
                     is_offline = False
         except Exception:
+            net.invalidate() # Could be the network dropping; re-probe before the next lookup
             return None
 
     return {
@@ -687,84 +1176,215 @@ def resolve_audio(query: str):
         "artist": artist,
         "vid": vid,
         "is_offline": is_offline,
-        "duration": duration
+        "duration": duration,
+        "format": fmt_label
     }
 
-def playback_engine(queries: List[str], repeat_mode: bool = False):
+def report_offline_misses(items):
+    """Explains which queued entries were skipped because there was no network."""
+    streamed = [i for i in items if isinstance(i, dict) and i.get('video_id')]
+    for item in items:
+        if not (isinstance(item, dict) and item.get('video_id')):
+            query = item['query'] if isinstance(item, dict) else item
+            console.print(f"[yellow]Offline: no local match for '{query}'[/yellow]")
+    if streamed:
+        console.print(f"[yellow]Offline: skipped {len(streamed)} streamed entries[/yellow]")
+
+def playback_engine(queries: list, repeat_mode: bool = False, visualizer: bool = False, quality: str = "auto"):
     """Handles the UI and process management for one or more songs."""
     layout = make_layout()
     repeat = repeat_mode
     controller = MPVController(IPC_SOCKET)
     player_cmd = get_player_command()
+    engine = NarrativeEngine()
+    analyzer = None
+    viz = None
+    ffmpeg = None
+    if numpy_available():
+        ffmpeg, _ = get_ffmpeg_tools()
+        if ffmpeg:
+            analyzer = BackgroundAnalyzer(ENVELOPE_DIR, ffmpeg)
+    layout["viz"].visible = visualizer
+
+    def start_viz(path, pos=0):
+        """Decodes for the spectrum only while its panel is on screen."""
+        nonlocal viz
+        if viz is None:
+            viz = SpectrumVisualizer(ffmpeg)
+        viz.load(path, pos)
+
+    queue = PlayQueue(queries)
+    inbox = Queue()  # Songs sent by 'spci enqueue' from another terminal
+    resolved = {}    # Queue handle -> (song info, resolved at), so repeat/previous don't resolve again
+    offline_misses = {}  # Queue handle -> entry that can't play without a network
+    server = QueueServer(QUEUE_PORT_FILE, inbox)
+    try:
+        server.start()
+    except OSError:
+        server = None
 
     try:
-        with Live(layout, refresh_per_second=20, screen=True):
+        with Live(layout, refresh_per_second=20, screen=True) as live:
+            item = queue.advance()
+            played_any = False
             while True:
-                for query in queries:
-                    song_info = resolve_audio(query)
-                    if not song_info:
-                        continue
-                    
-                    audio_source = song_info['audio_source']
-                    title = song_info['title']
-                    artist = song_info['artist']
-                    vid = song_info['vid']
-                    is_offline = song_info['is_offline']
-                    duration = song_info['duration']
-
-                    log_history(title, vid)
-
-                    process = subprocess.Popen(player_cmd + [audio_source],
-                                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                    start_time = time.time()
-                    skip = False
+                if item is None:
+                    # Don't spin forever on a queue where nothing resolves
+                    if not repeat or not played_any:
+                        break
+                    queue.rewind()
+                    played_any = False
+                    item = queue.advance()
+                    continue
+
+                handle = queue.current.handle
+                cached, resolved_at = resolved.get(handle, (None, 0))
+                # Local files never go stale; stream URLs do
+                if cached and (cached['is_offline'] or time.time() - resolved_at < STREAM_URL_TTL):
+                    song_info = cached
+                else:
+                    song_info = resolve_audio(item, quality)
+                    resolved_at = time.time()
+                if not song_info:
+                    if not net.is_online():
+                        offline_misses[handle] = item
+                    item = queue.advance()
+                    continue
+                resolved[handle] = (song_info, resolved_at)
+
+                audio_source = song_info['audio_source']
+                title = song_info['title']
+                artist = song_info['artist']
+                vid = song_info['vid']
+                is_offline = song_info['is_offline']
+                duration = song_info['duration']
+                fmt_label = song_info['format']
+                stream_probe_until = 0 if is_offline else time.time() + STREAM_PROBE_WINDOW
+                peak_speed = 0
+
+                log_history(title, vid)
+                engine.set_track(vid)
+                if analyzer and is_offline:
+                    analyzer.submit(vid, audio_source)
+                if viz:
+                    viz.stop()
+                if ffmpeg and is_offline and layout["viz"].visible:
+                    start_viz(audio_source)
+
+                process = subprocess.Popen(player_cmd + [audio_source],
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                start_time = time.time()
+                go_back = skipped = False
+                
+                while process.poll() is None:
+                    key = get_key()
+                    if key in [b'r', b'R', b'\x12']:
+                        repeat = not repeat
+                    elif key == b'\x10': # Ctrl+P
+                        controller.toggle_pause()
+                    elif key == b'n': # Next
+                        process.terminate()
+                        skipped = True
+                        break
+                    elif key == b'p': # Previous (history-aware)
+                        process.terminate()
+                        go_back = skipped = True
+                        break
+                    elif key in [b's', b'S']:
+                        queue.unshuffle() if queue.shuffled else queue.shuffle()
+                    elif key in [b'a', b'A']:
+                        # Drop out of the full-screen view just long enough to type
+                        live.stop()
+                        new_query = console.input("[bold cyan]Add to queue> [/bold cyan]").strip()
+                        live.start(refresh=True)
+                        if new_query:
+                            queue.append(new_query)
+                    elif key in [b'v', b'V']:
+                        layout["viz"].visible = not layout["viz"].visible
+                        if not layout["viz"].visible:
+                            if viz: viz.stop()
+                        elif ffmpeg and is_offline:
+                            start_viz(audio_source, controller.get_pos() or (time.time() - start_time))
+
+                    while not inbox.empty():
+                        queue.append(inbox.get_nowait())
                     
-                    while process.poll() is None:
-                        key = get_key()
-                        if key in [b'r', b'R', b'\x12']:
-                            repeat = not repeat
-                        elif key == b'\x10': # Ctrl+P
-                            controller.toggle_pause()
-                        elif key == b'n': # Next
-                            process.terminate()
-                            skip = True
-                            break
-                        
-                        # State Polling
-                        if platform.system() == "Windows":
-                            cur_pos = time.time() - start_time
-                            cur_dur = duration or 240
+                    # State Polling
+                    if platform.system() == "Windows":
+                        cur_pos = time.time() - start_time
+                        cur_dur = duration or 240
+                    else:
+                        cur_pos = controller.get_pos() or (time.time() - start_time)
+                        cur_dur = duration or controller.get_duration() or 1
+                        # mpv fills its cache at full link speed right after start; sample that burst
+                        if stream_probe_until:
+                            peak_speed = max(peak_speed, controller.get_cache_speed() or 0)
+                            if time.time() >= stream_probe_until:
+                                bandwidth.record(peak_speed, 1.0)
+                                stream_probe_until = 0
+
+                    layout["header"].update(get_header())
+                    layout["now"].update(get_now_playing_panel(title, artist, is_offline, cur_pos, cur_dur, engine, fmt_label))
+                    layout["right"].update(get_stats_panel(queue.upcoming(3)))
+                    layout["footer"].update(get_controls_panel(repeat, queue.shuffled, len(queue)))
+                    if layout["viz"].visible:
+                        if not ffmpeg:
+                            layout["viz"].update(get_visualizer_placeholder("Visualizer needs NumPy and ffmpeg (pip install spci-sonic-pulse[analysis])"))
+                        elif not is_offline:
+                            layout["viz"].update(get_visualizer_placeholder("Visualizer is available for offline tracks"))
                         else:
-                            cur_pos = controller.get_pos() or (time.time() - start_time)
-                            cur_dur = controller.get_duration() or duration or 1
-
-                        layout["header"].update(get_header())
-                        layout["left"].update(get_now_playing_panel(title, artist, is_offline, cur_pos, cur_dur))
-                        layout["right"].update(get_stats_panel())
-                        layout["footer"].update(get_controls_panel(repeat))
-                        time.sleep(0.05)
-                    
-                    if skip: continue
-                if not repeat: break
+                            layout["viz"].update(viz.render(cur_pos))
+                    time.sleep(0.05)
+
+                if skipped or time.time() - start_time >= QUICK_EXIT:
+                    played_any = True
+                elif not is_offline:
+                    # Player quit at once, most likely an expired URL: resolve afresh next time
+                    resolved.pop(handle, None)
+
+                # Nothing played before this one: 'previous' just restarts it
+                item = (queue.previous() or item) if go_back else queue.advance()
     except KeyboardInterrupt:
         if 'process' in locals(): process.terminate()
         console.show_cursor()
         console.print("\n[yellow]Playback stopped.[/yellow]")
+    finally:
+        if viz: viz.stop()
+        if server: server.close()
+        # The full-screen view would have swallowed these, so report them once it's gone
+        report_offline_misses(list(offline_misses.values()))
 
 @app.command(name="play-pl", short_help="Play a playlist")
-def play_pl(identifier: str):
+def play_pl(
+    identifier: str,
+    viz: bool = typer.Option(False, "--viz", help="Start with the spectrum visualizer on"),
+    quality: str = typer.Option("auto", "--quality", "-q", callback=parse_quality, help="Stream quality: auto, low, medium, high or a kbps cap"),
+):
     """Plays all songs in a playlist."""
     Playlist = Query()
     pl = playlist_table.get((Playlist.id == identifier) | (Playlist.name == identifier))
     if pl:
-        playback_engine(pl['songs'])
+        playback_engine(playlist_entries(pl), visualizer=viz, quality=quality)
     else:
         console.print(f"[bold red]Playlist not found.[/bold red]")
 
 @app.command(short_help="Play a song (Checks offline first)")
-def play(query: str):
+def play(
+    query: str,
+    viz: bool = typer.Option(False, "--viz", help="Start with the spectrum visualizer on"),
+    quality: str = typer.Option("auto", "--quality", "-q", callback=parse_quality, help="Stream quality: auto, low, medium, high or a kbps cap"),
+):
     """Handles playback with robust variable initialization."""
-    playback_engine([query])
+    playback_engine([query], visualizer=viz, quality=quality)
+
+@app.command(short_help="Add songs to the running player's queue")
+def enqueue(queries: List[str]):
+    """Sends songs to an active playback session without interrupting the audio."""
+    try:
+        queued = send_to_session(QUEUE_PORT_FILE, queries)
+        console.print(f"[bold green]Queued {queued} song(s).[/bold green]")
+    except (OSError, ValueError):
+        console.print("[bold red]Error:[/bold red] No active playback session. Start one with 'play' or 'play-pl'.")
 
 @app.command(short_help="Remove a song from your offline favorites")
 def delete_fav(video_id: str):
@@ -781,14 +1401,201 @@ def delete_fav(video_id: str):
     try:
         if file_path and os.path.exists(file_path):
             os.remove(file_path)
-            console.print(f"[dim]Physical file removed: {video_id}.mp3[/dim]")
+            console.print(f"[dim]Physical file removed: {os.path.basename(file_path)}[/dim]")
     except Exception as e:
         console.print(f"[bold yellow]Warning:[/bold yellow] Could not delete file: {e}")
 
+    remove_envelope(video_id)
+
     # 2. Remove from NoSQL Database
     fav_table.remove(Song.video_id == video_id)
     console.print(f"[bold green]Deleted![/bold green] '{item['title']}' has been removed from SPCI.")
 
+@library_app.command(short_help="Remux/transcode offline files to a compact format")
+def optimize(
+    target: str = typer.Option("opus", "--target", "-t", help=f"Target format: {', '.join(TARGETS)}"),
+    bitrate: int = typer.Option(96, "--bitrate", "-b", help="Bitrate (kbps) used when a transcode is needed"),
+    workers: int = typer.Option(0, "--workers", "-w", help="Worker processes (0 = CPU count)"),
+):
+    """Stream-copies when the codec already matches, otherwise transcodes, one process per core."""
+    if target not in TARGETS:
+        console.print(f"[bold red]Error:[/bold red] Unknown target '{target}'. Choose from: {', '.join(TARGETS)}")
+        return
+
+    ffmpeg, ffprobe = get_ffmpeg_tools()
+    if not ffmpeg or not ffprobe:
+        console.print("[bold red]Error:[/bold red] ffmpeg/ffprobe not found. [bold green]Installing now...[/bold green]")
+        auto_install_dependencies(platform.system())
+        return
+
+    favs = [f for f in fav_table.all() if f.get('path') and os.path.exists(f['path'])]
+    if not favs:
+        console.print("[dim]No offline songs found. Try 'add-fav <VideoID>'[/dim]")
+        return
+
+    Song = Query()
+    saved, changed, failed = 0, 0, 0
+    max_workers = max(1, workers or os.cpu_count() or 1)
+
+    with Progress(SpinnerColumn(), TextColumn("[green]Optimizing library..."), BarColumn(), TextColumn("{task.completed}/{task.total}"), console=console) as progress:
+        task = progress.add_task("Optimizing", total=len(favs))
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(optimize_track, f['video_id'], f['path'], target, bitrate, ffmpeg, ffprobe): f for f in favs}
+            for future in as_completed(futures):
+                progress.update(task, advance=1)
+                try:
+                    res = future.result()
+                except Exception as e:  # e.g. BrokenProcessPool: report it, keep the rest
+                    res = {'video_id': futures[future]['video_id'], 'error': str(e) or type(e).__name__}
+
+                if res['error']:
+                    failed += 1
+                    progress.console.print(f"[bold red]Failed:[/bold red] {res['video_id']} [dim]{res['error'][:80]}[/dim]")
+                    continue
+                if res['action'] == "skip":
+                    continue
+
+                # New file is already in place; point the DB at it before dropping the old one
+                fav_table.update({
+                    'path': res['new_path'],
+                    'size': res['new_size'],
+                    'codec': res['codec'],
+                    'bitrate': res['bitrate']
+                }, Song.video_id == res['video_id'])
+                try:
+                    if res['new_path'] != res['old_path'] and os.path.exists(res['old_path']):
+                        os.remove(res['old_path'])
+                except OSError as e:
+                    progress.console.print(f"[bold yellow]Warning:[/bold yellow] Could not delete {os.path.basename(res['old_path'])}: {e}")
+
+                changed += 1
+                saved += res['old_size'] - res['new_size']
+
+    console.print(f"[bold green]Done![/bold green] {changed} file(s) converted to {target}, "
+                  f"[bold cyan]{format_bytes(saved)}[/bold cyan] saved."
+                  + (f" [bold red]{failed} failed.[/bold red]" if failed else ""))
+
+@library_app.command(short_help="Probe offline files and reconcile them with the database")
+def scan(
+    force: bool = typer.Option(False, "--force", "-f", help="Re-probe files that already have metadata"),
+    prune: bool = typer.Option(False, "--prune", help="Drop favorites whose audio file is gone, with their envelope cache"),
+    workers: int = typer.Option(0, "--workers", "-w", help="Worker processes (0 = CPU count)"),
+):
+    """Backfills duration, codec, bitrate and size with ffprobe, one process per core."""
+    _, ffprobe = get_ffmpeg_tools()
+    if not ffprobe:
+        console.print("[bold red]Error:[/bold red] ffprobe not found. [bold green]Installing now...[/bold green]")
+        auto_install_dependencies(platform.system())
+        return
+
+    Song = Query()
+    on_disk = {}
+    for name in os.listdir(FAV_DIR):
+        stem, ext = os.path.splitext(name)
+        # Only finished tracks: skips yt-dlp leftovers like X.webm.ytdl, X.temp.webm or X.f251.webm
+        if ext.lower() in AUDIO_EXTS and VIDEO_ID_RE.match(stem):
+            on_disk[stem] = os.path.join(FAV_DIR, name)
+
+    jobs, missing = [], []
+    for song in fav_table.all():
+        vid = song['video_id']
+        path = song.get('path') if song.get('path') and os.path.exists(song['path']) else on_disk.get(vid)
+        on_disk.pop(vid, None)
+        if not path:
+            missing.append(song)
+            continue
+        if path != song.get('path'):
+            fav_table.update({'path': path}, Song.video_id == vid)
+        if force or not song.get('duration') or not song.get('codec'):
+            jobs.append((vid, path, True))
+
+    # Files in FAV_DIR that the database has forgotten about
+    jobs += [(vid, path, False) for vid, path in on_disk.items()]
+
+    updated, adopted, failed = 0, 0, 0
+    if jobs:
+        with Progress(SpinnerColumn(), TextColumn("[green]Scanning library..."), BarColumn(), TextColumn("{task.completed}/{task.total}"), console=console) as progress:
+            task = progress.add_task("Scanning", total=len(jobs))
+            known = {vid: in_db for vid, _, in_db in jobs}
+            with ProcessPoolExecutor(max_workers=max(1, workers or os.cpu_count() or 1)) as pool:
+                futures = {pool.submit(scan_track, vid, path, ffprobe): vid for vid, path, _ in jobs}
+                for future in as_completed(futures):
+                    progress.update(task, advance=1)
+                    try:
+                        res = future.result()
+                    except Exception as e:  # e.g. BrokenProcessPool: report it, keep the rest
+                        res = {'video_id': futures[future], 'error': str(e) or type(e).__name__}
+                    if res['error']:
+                        failed += 1
+                        progress.console.print(f"[bold red]Probe Failed:[/bold red] {res['video_id']} [dim]{res['error'][:80]}[/dim]")
+                        continue
+
+                    info = res['info']
+                    record = {k: info[k] for k in ('duration', 'codec', 'bitrate', 'size')}
+                    if known[res['video_id']]:
+                        fav_table.update(record, Song.video_id == res['video_id'])
+                        updated += 1
+                    else:
+                        record.update({
+                            'video_id': res['video_id'],
+                            'title': info['title'] or res['video_id'],
+                            'artist': info['artist'] or "Unknown",
+                            'path': res['path']
+                        })
+                        fav_table.upsert(record, Song.video_id == res['video_id'])
+                        adopted += 1
+
+    for song in missing:
+        if prune:
+            fav_table.remove(Song.video_id == song['video_id'])
+            remove_envelope(song['video_id'])
+        else:
+            console.print(f"[yellow]Missing file:[/yellow] {song.get('title')} ({song['video_id']})")
+
+    console.print(f"[bold green]Scan complete.[/bold green] {updated} updated, {adopted} adopted from {os.path.basename(FAV_DIR)}, "
+                  f"{len(missing)} missing" + (" (pruned)" if prune and missing else "") + "."
+                  + (f" [bold red]{failed} failed.[/bold red]" if failed else ""))
+
+@library_app.command(short_help="Build energy envelopes for offline tracks")
+def analyze(
+    force: bool = typer.Option(False, "--force", "-f", help="Re-analyze tracks that already have an envelope"),
+    workers: int = typer.Option(0, "--workers", "-w", help="Worker processes (0 = CPU count)"),
+):
+    """Decodes each track through ffmpeg and caches its energy envelope for the Narrative Engine."""
+    if not numpy_available():
+        console.print("[bold red]Error:[/bold red] Analysis needs NumPy. Install it with [bold]pip install spci-sonic-pulse[analysis][/bold]")
+        return
+    ffmpeg, _ = get_ffmpeg_tools()
+    if not ffmpeg:
+        console.print("[bold red]Error:[/bold red] ffmpeg not found. [bold green]Installing now...[/bold green]")
+        auto_install_dependencies(platform.system())
+        return
+
+    jobs = [f for f in fav_table.all()
+            if f.get('path') and os.path.exists(f['path'])
+            and (force or not os.path.exists(envelope_path(ENVELOPE_DIR, f['video_id'])))]
+    if not jobs:
+        console.print("[dim]Every offline track is already analyzed.[/dim]")
+        return
+
+    failed = 0
+    with Progress(SpinnerColumn(), TextColumn("[green]Analyzing tracks..."), BarColumn(), TextColumn("{task.completed}/{task.total}"), console=console) as progress:
+        task = progress.add_task("Analyzing", total=len(jobs))
+        with ProcessPoolExecutor(max_workers=max(1, workers or os.cpu_count() or 1)) as pool:
+            futures = {pool.submit(analyze_track, f['video_id'], f['path'], ENVELOPE_DIR, ffmpeg): f for f in jobs}
+            for future in as_completed(futures):
+                progress.update(task, advance=1)
+                try:
+                    error = future.result()
+                except Exception as e:  # e.g. BrokenProcessPool: report it, keep the rest
+                    error = str(e) or type(e).__name__
+                if error:
+                    failed += 1
+                    progress.console.print(f"[bold red]Analysis Failed:[/bold red] {futures[future]['video_id']} [dim]{error[:80]}[/dim]")
+
+    console.print(f"[bold green]Analyzed {len(jobs) - failed} track(s).[/bold green]"
+                  + (f" [bold red]{failed} failed.[/bold red]" if failed else ""))
+
 @app.command()
 def show_history():
     if os.path.exists(HISTORY_FILE):
@@ -807,9 +1614,11 @@ def show_history():
 
 @app.command()
 def clear_history():
-    if os.path.exists(HISTORY_FILE):
+    with HISTORY_LOCK:
+        if not os.path.exists(HISTORY_FILE):
+            return
         os.remove(HISTORY_FILE)
-        console.print("[bold green]History cleared.[/bold green]")
+    console.print("[bold green]History cleared.[/bold green]")
 
 
 @app.callback(invoke_without_command=True)
@@ -0,0 +1,234 @@
+import os
+import json
+import random
+import socket
+import threading
+
+class _Node:
+    __slots__ = ("handle", "item", "prev", "next")
+
+    def __init__(self, handle, item):
+        self.handle = handle
+        self.item = item
+        self.prev = None
+        self.next = None
+
+class PlayQueue:
+    """
+    Doubly linked play queue addressed by integer handles.
+    append, remove(handle) and jump(handle) are O(1); shuffle is an
+    in-place Fisher-Yates over the upcoming tracks and can be undone.
+    """
+    def __init__(self, items=()):
+        self._nodes = {}
+        self._head = None
+        self._tail = None
+        self._counter = 0
+        self.current = None
+        self._resume = None        # Where to continue if the current track was removed
+        self._history = []         # Handles actually played, for 'previous'
+        self._unshuffled = None    # Order to restore when shuffle is switched off
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        node = self._head
+        while node:
+            yield node.handle, node.item
+            node = node.next
+
+    @property
+    def shuffled(self):
+        return self._unshuffled is not None
+
+    def _link_after(self, node, after):
+        node.prev = after
+        node.next = after.next if after else self._head
+        if node.next:
+            node.next.prev = node
+        else:
+            self._tail = node
+        if after:
+            after.next = node
+        else:
+            self._head = node
+
+    def _unlink(self, node):
+        if node.prev: node.prev.next = node.next
+        else: self._head = node.next
+        if node.next: node.next.prev = node.prev
+        else: self._tail = node.prev
+
+    def append(self, item):
+        """Adds an item at the end and returns its handle."""
+        self._counter += 1
+        node = _Node(self._counter, item)
+        self._nodes[node.handle] = node
+        self._link_after(node, self._tail)
+        # Queue already ran out: the new track is where playback picks up again
+        if self.current is None and self._resume is None and self._history:
+            self._resume = node
+        return node.handle
+
+    def remove(self, handle):
+        node = self._nodes.pop(handle, None)
+        if not node:
+            return False
+        if node is self._resume:
+            self._resume = node.next
+        if node is self.current:
+            self.current, self._resume = None, node.next
+        self._unlink(node)
+        return True
+
+    def _move_to(self, node):
+        if self.current:
+            self._history.append(self.current.handle)
+        self.current, self._resume = node, None
+        return node.item if node else None
+
+    def advance(self):
+        """Moves to the next track and returns its item (None at the end of the queue)."""
+        if self.current:
+            nxt = self.current.next
+        else:
+            nxt = self._resume if self._resume else (self._head if not self._history else None)
+        return self._move_to(nxt)
+
+    def jump(self, handle):
+        node = self._nodes.get(handle)
+        return self._move_to(node) if node else None
+
+    def previous(self):
+        """Goes back to the last track actually played (not just the list predecessor)."""
+        while self._history:
+            node = self._nodes.get(self._history.pop())
+            if node:
+                self.current, self._resume = node, None
+                return node.item
+        return None
+
+    def rewind(self):
+        """Starts over from the head, used by repeat mode."""
+        self.current, self._resume = None, None
+        self._history.clear()
+
+    def _upcoming_nodes(self):
+        node = self.current.next if self.current else (self._resume or (self._head if not self._history else None))
+        nodes = []
+        while node:
+            nodes.append(node)
+            node = node.next
+        return nodes
+
+    def _relink(self, anchor, nodes):
+        """Re-chains 'nodes' after 'anchor' (None = from the head)."""
+        prev = anchor
+        for node in nodes:
+            node.prev = prev
+            if prev: prev.next = node
+            else: self._head = node
+            prev = node
+        if prev: prev.next = None
+        self._tail = prev if prev else anchor
+
+    def shuffle(self):
+        """Fisher-Yates over the upcoming tracks; the current track and history stay put."""
+        if self._unshuffled is None:
+            self._unshuffled = [h for h, _ in self]
+        upcoming = self._upcoming_nodes()
+        if not upcoming:
+            return
+        anchor = upcoming[0].prev
+        for i in range(len(upcoming) - 1, 0, -1):
+            j = random.randint(0, i)
+            upcoming[i], upcoming[j] = upcoming[j], upcoming[i]
+        self._relink(anchor, upcoming)
+        if self.current is None and self._resume:
+            self._resume = upcoming[0]
+
+    def unshuffle(self):
+        """
+        Puts the upcoming tracks back in their order from before shuffle;
+        tracks added since go at the end. Played tracks stay where they are.
+        """
+        if self._unshuffled is None:
+            return
+        rank = {h: i for i, h in enumerate(self._unshuffled)}
+        self._unshuffled = None
+        upcoming = self._upcoming_nodes()
+        if not upcoming:
+            return
+        anchor = upcoming[0].prev
+        # Handles grow monotonically, so newer tracks sort after every saved one in append order
+        upcoming.sort(key=lambda n: rank.get(n.handle, len(rank) + n.handle))
+        self._relink(anchor, upcoming)
+        if self.current is None and self._resume:
+            self._resume = upcoming[0]
+
+    def upcoming(self, limit=5):
+        return [n.item for n in self._upcoming_nodes()[:limit]]
+
+class QueueServer:
+    """
+    Lets another spci process enqueue songs into the running session.
+    Listens on a localhost port recorded in 'port_file'; requests land in
+    'inbox' and are applied by the playback loop on its own thread.
+    """
+    def __init__(self, port_file, inbox):
+        self.port_file = port_file
+        self.inbox = inbox
+        self._sock = None
+        self.port = None
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(4)
+        self.port = self._sock.getsockname()[1]
+        tmp = self.port_file + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(self.port))
+        os.replace(tmp, self.port_file)
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return  # Socket closed at the end of the session
+            with client:
+                try:
+                    client.settimeout(2)
+                    request = json.loads(client.makefile("r", encoding="utf-8").readline() or "{}")
+                    queries = [q for q in request.get("add", []) if isinstance(q, str) and q.strip()]
+                    for q in queries:
+                        self.inbox.put(q)
+                    client.sendall((json.dumps({"ok": True, "queued": len(queries)}) + "\n").encode())
+                except (OSError, ValueError):
+                    pass
+
+    def close(self):
+        if not self._sock:
+            return
+        self._sock.close()
+        # Only clean up the port file if a newer session hasn't taken it over
+        try:
+            with open(self.port_file) as f:
+                if f.read().strip() == str(self.port):
+                    os.remove(self.port_file)
+        except OSError:
+            pass
+
+def send_to_session(port_file, queries):
+    """Enqueues into a running session. Raises OSError when no session is listening."""
+    with open(port_file) as f:
+        port = int(f.read().strip())
+    with socket.create_connection(("127.0.0.1", port), timeout=2) as client:
+        client.sendall((json.dumps({"add": list(queries)}) + "\n").encode())
+        reply = json.loads(client.makefile("r", encoding="utf-8").readline() or "{}")
+    return reply.get("queued", 0)
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import threading
+from tinydb import TinyDB
+from tinydb.table import Table
+from tinydb.storages import Storage
+
+if os.name == "nt":
+    import msvcrt
+
+    def _lock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _unlock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+REPLACE_RETRIES = 10
+REPLACE_BACKOFF = 0.01  # Seconds, grows linearly per attempt (~0.5 s in total)
+
+class FileLock:
+    """
+    Exclusive lock shared by every spci process, held on '<path>.lock'.
+    Re-entrant within a process, so nested writes don't deadlock.
+    """
+    def __init__(self, path):
+        self.path = path + ".lock"
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._rlock.acquire()
+        try:
+            if self._depth == 0:
+                self._file = open(self.path, "a+")
+                _lock(self._file)
+            self._depth += 1
+        except Exception:
+            if self._file:
+                self._file.close()
+                self._file = None
+            self._rlock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            _unlock(self._file)
+            self._file.close()
+            self._file = None
+        self._rlock.release()
+
+def _replace(src, dst):
+    """
+    os.replace that rides out readers holding 'dst' open for a moment:
+    Windows refuses the rename while the file is open elsewhere.
+    """
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(REPLACE_BACKOFF * (attempt + 1))
+
+def atomic_write(path, text):
+    """Writes a temp file, syncs it and renames it over 'path': readers see old or new, never half."""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+class AtomicJSONStorage(Storage):
+    """TinyDB storage with lock-free reads and locked, atomically renamed writes."""
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.lock = FileLock(path)
+        self.kwargs = kwargs
+
+    def read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        return json.loads(text) if text.strip() else None
+
+    def write(self, data):
+        with self.lock:
+            atomic_write(self.path, json.dumps(data, **self.kwargs))
+
+    def close(self):
+        pass
+
+class SharedTable(Table):
+    """
+    Table safe to share with other spci processes: each write reads, modifies
+    and writes under the storage lock, and nothing is cached between calls
+    because another process may have changed the file in the meantime.
+    """
+    def __init__(self, storage, name, cache_size=0, persist_empty=False):
+        super().__init__(storage, name, cache_size=cache_size, persist_empty=persist_empty)
+
+    def _locked(self, op, *args):
+        with self._storage.lock:
+            self._next_id = None  # Another process may have inserted since we last looked
+            return op(*args)
+
+    def insert(self, document):
+        return self._locked(super().insert, document)
+
+    def insert_multiple(self, documents):
+        return self._locked(super().insert_multiple, documents)
+
+    def upsert(self, document, cond=None):
+        return self._locked(super().upsert, document, cond)
+
+    def _update_table(self, updater):
+        with self._storage.lock:
+            super()._update_table(updater)
+
+class SharedTinyDB(TinyDB):
+    table_class = SharedTable
+
+    def __init__(self, path):
+        super().__init__(path, storage=AtomicJSONStorage)
+
+def append_line(path, line, lock):
+    """Appends one line under 'lock' with a single write call."""
+    with lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
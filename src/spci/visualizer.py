@@ -0,0 +1,170 @@
+import time
+import threading
+import subprocess
+from rich.text import Text
+from rich.panel import Panel
+from rich.align import Align
+from rich import box
+
+VIZ_RATE = 22050        # Mono decode rate for the tap
+FFT_SIZE = 2048
+BATCH = 4               # Overlapping windows averaged per frame (one batched FFT)
+BANDS = 32
+MIN_FREQ = 40.0
+HEIGHT = 6
+FPS = 20
+MAX_CPU_SHARE = 0.05    # Back off the frame rate if analysis takes more than this
+DECAY = 0.85            # Bars fall smoothly instead of snapping down
+READ_CHUNK = 1 << 14     # Bytes per pipe read (~0.4 s of audio)
+RING_SEC = 4             # Decoded audio kept in memory, whatever the track length
+LEAD_SEC = 1.0           # How far the decoder may run ahead of the player
+
+BLOCKS = " ▁▂▃▄▅▆▇█"
+ROW_STYLES = ["bold red", "bold yellow", "yellow", "green", "green", "bold green"]
+
+class SpectrumVisualizer:
+    """
+    Log-band spectrum of the current offline track.
+    An ffmpeg process decodes into a small ring buffer on a reader thread
+    that stays only LEAD_SEC ahead of the player (the blocked pipe stalls
+    ffmpeg); each frame takes the samples just before the player position,
+    so pausing or a slow decoder never makes the bars drift from the audio.
+    """
+    def __init__(self, ffmpeg="ffmpeg", bands=BANDS, height=HEIGHT):
+        import numpy as np
+        self.np = np
+        self.ffmpeg = ffmpeg
+        self.height = height
+        self.hop = FFT_SIZE // 2
+
+        # Everything below is allocated once and reused every frame
+        self._window = np.hanning(FFT_SIZE).astype(np.float32)
+        self._frames = np.zeros((BATCH, FFT_SIZE), dtype=np.float32)
+        self._levels = np.zeros(bands, dtype=np.float32)
+        self._scratch = np.zeros(bands, dtype=np.float32)
+        self._rows = np.arange(height, 0, -1, dtype=np.float32)[:, None] - 1
+        span = FFT_SIZE + (BATCH - 1) * self.hop
+        self._span = np.arange(span)
+        self._idx = np.zeros(span, dtype=self._span.dtype)
+        self._seg = np.zeros(span, dtype=np.int16)
+        self._ring_size = RING_SEC * VIZ_RATE
+        self._glyphs = np.array(list(BLOCKS))
+
+        freqs = np.fft.rfftfreq(FFT_SIZE, 1.0 / VIZ_RATE)
+        edges = np.searchsorted(freqs, np.geomspace(MIN_FREQ, VIZ_RATE / 2, bands + 1)[:-1])
+        for i in range(1, bands):  # Low bands are narrower than one bin; keep each band non-empty
+            edges[i] = max(edges[i], edges[i - 1] + 1)
+        self._edges = edges
+        self._widths = np.diff(np.append(edges, len(freqs))).astype(np.float32)
+        self._ref = FFT_SIZE * 32768.0 / 4  # Rough full-scale magnitude for a Hann window
+
+        # (ring, first sample, samples written), swapped as one tuple so a frame never mixes two tracks
+        self._pcm = (np.zeros(self._ring_size, dtype=np.int16), 0, 0)
+        self._pos = 0.0
+        self._proc = None
+        self._interval = 1.0 / FPS
+        self._last_render = 0
+        self._cached = None
+
+    def load(self, path, start=0):
+        """Starts decoding a new track in the background, from 'start' seconds in."""
+        np = self.np
+        self.stop()
+        first = int(start * VIZ_RATE)
+        # A fresh ring per track: a reader still finishing the old one can't scribble over it
+        self._pcm = (np.zeros(self._ring_size, dtype=np.int16), first, first)
+        self._pos = start
+        self._levels.fill(0)
+        self._cached = None
+        cmd = [self.ffmpeg, "-v", "error", "-ss", f"{start:.2f}", "-i", path, "-vn", "-ac", "1",
+               "-ar", str(VIZ_RATE), "-f", "s16le", "-"]
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        threading.Thread(target=self._read, args=(self._proc,), daemon=True).start()
+
+    def stop(self):
+        if self._proc and self._proc.poll() is None:
+            self._proc.terminate()
+        self._proc = None
+
+    def _read(self, proc):
+        np = self.np
+        leftover = b""
+        ring, first, written = self._pcm
+        size = len(ring)
+        while proc is self._proc:
+            # Far enough ahead of the player: leave the pipe full so ffmpeg blocks instead of racing on
+            if written - self._pos * VIZ_RATE > LEAD_SEC * VIZ_RATE:
+                time.sleep(0.05)
+                continue
+            chunk = proc.stdout.read(READ_CHUNK)
+            if not chunk:
+                break
+            chunk = leftover + chunk
+            cut = len(chunk) & ~1  # Pipe reads can split a sample
+            chunk, leftover = chunk[:cut], chunk[cut:]
+            samples = np.frombuffer(chunk, dtype=np.int16)
+
+            at = written % size
+            head = min(len(samples), size - at)
+            ring[at:at + head] = samples[:head]
+            ring[:len(samples) - head] = samples[head:]
+            written += len(samples)
+            if proc is not self._proc:
+                break  # A newer track took over while we were reading
+            self._pcm = (ring, first, written)
+
+    def _update_levels(self, pos):
+        np = self.np
+        self._pos = pos
+        ring, first, written = self._pcm
+        size = len(ring)
+        end = min(int(pos * VIZ_RATE), written)
+        start = end - len(self._span)
+        # Not decoded yet, or already overwritten (the next read may be landing on the oldest samples)
+        if start < max(first, written + READ_CHUNK // 2 - size):
+            self._levels *= DECAY
+            return
+
+        np.add(self._span, start, out=self._idx)
+        np.remainder(self._idx, size, out=self._idx)
+        np.take(ring, self._idx, out=self._seg)
+        windows = np.lib.stride_tricks.sliding_window_view(self._seg, FFT_SIZE)[::self.hop]
+        np.multiply(windows, self._window, out=self._frames)
+        mag = np.abs(np.fft.rfft(self._frames, axis=1)).mean(axis=0)
+
+        bands = np.add.reduceat(mag, self._edges) / self._widths
+        np.log10(bands / self._ref + 1e-9, out=self._scratch)
+        self._scratch *= 20.0 / 60.0   # dBFS over a 60 dB range
+        self._scratch += 1.0
+        np.clip(self._scratch, 0.0, 1.0, out=self._scratch)
+
+        self._levels *= DECAY
+        np.maximum(self._levels, self._scratch, out=self._levels)
+
+    def render(self, pos):
+        """Returns the visualizer panel, recomputing at most once per frame budget."""
+        now = time.perf_counter()
+        if self._cached is not None and now - self._last_render < self._interval:
+            return self._cached
+        self._last_render = now
+
+        np = self.np
+        self._update_levels(pos)
+        fill = self._levels[None, :] * self.height - self._rows
+        idx = np.clip((fill * 8).astype(np.int8), 0, 8)
+        grid = self._glyphs[idx]
+
+        text = Text()
+        for r, row in enumerate(grid):
+            text.append(" ".join(row), style=ROW_STYLES[min(r, len(ROW_STYLES) - 1)])
+            if r < self.height - 1:
+                text.append("\n")
+
+        # Keep the visualizer within its CPU share by stretching the frame interval
+        cost = time.perf_counter() - now
+        self._interval = max(1.0 / FPS, cost / MAX_CPU_SHARE)
+        self._cached = Panel(Align.center(text), title="[bold cyan]SPECTRUM[/bold cyan]", border_style="cyan", box=box.ROUNDED)
+        return self._cached
+
+def get_visualizer_placeholder(message):
+    return Panel(Align.center(f"[dim]{message}[/dim]", vertical="middle"), title="[bold cyan]SPECTRUM[/bold cyan]", border_style="cyan", box=box.ROUNDED)
@@ -0,0 +1,84 @@
+import pytest
+
+from spci.analysis import (
+    HEADER, HOP_SEC, MAGIC, PHASE_NAMES, VERSION,
+    Envelope, compute_envelope, envelope_path, segment_phases, write_envelope,
+)
+
+np = pytest.importorskip("numpy")
+
+
+def song_envelope():
+    """Quiet intro, long ramp, loud plateau, fade, quiet outro (one value per HOP_SEC)."""
+    return np.concatenate([
+        np.full(60, 0.05),
+        np.linspace(0.05, 0.7, 80),
+        np.full(80, 0.95),
+        np.linspace(0.7, 0.3, 60),
+        np.full(60, 0.05),
+    ]).astype(np.float32)
+
+
+def test_segment_phases_finds_the_song_shape():
+    starts, codes = segment_phases(song_envelope())
+    assert [PHASE_NAMES[c] for c in codes] == ["Intro", "Build", "Peak", "Release", "Outro"]
+    assert starts[0] == 0
+    assert list(starts) == sorted(starts)
+
+
+def test_segment_phases_is_deterministic():
+    a_starts, a_codes = segment_phases(song_envelope())
+    b_starts, b_codes = segment_phases(song_envelope())
+    assert np.array_equal(a_starts, b_starts)
+    assert np.array_equal(a_codes, b_codes)
+
+
+def test_segment_phases_rejects_silence_and_handles_empty():
+    with pytest.raises(ValueError):
+        segment_phases(np.zeros(100, dtype=np.float32))
+    starts, codes = segment_phases(np.zeros(0, dtype=np.float32))
+    assert list(starts) == [0] and PHASE_NAMES[codes[0]] == "Intro"
+
+
+def test_compute_envelope_is_scaled_to_unit_range():
+    rng = np.random.default_rng(0)
+    pcm = (rng.standard_normal(11025 * 20) * 8000).astype(np.int16)
+    env = compute_envelope(pcm)
+    assert len(env) == int(20 / HOP_SEC)
+    assert env.min() >= 0 and env.max() <= 1.0
+    assert len(compute_envelope(pcm[:10])) == 0
+
+
+def test_cache_round_trip_and_phase_lookup(tmp_path):
+    env = song_envelope()
+    starts, codes = segment_phases(env)
+    write_envelope(envelope_path(str(tmp_path), "abcdefghijk"), env, starts, codes)
+    assert not list(tmp_path.glob("*.part"))
+
+    cached = Envelope.load(str(tmp_path), "abcdefghijk")
+    assert cached.hop == HOP_SEC
+    assert list(cached.starts) == pytest.approx(list(starts))
+    assert bytes(cached.codes) == codes.tobytes()
+    assert len(cached.energy) == len(env)
+    assert cached.energy[100] == int(env[100] * 255)
+
+    # Every position maps to the segment whose start is the last one at or before it
+    for i, start in enumerate(starts):
+        assert cached.phase_at(float(start)) == PHASE_NAMES[codes[i]]
+        assert cached.phase_at(float(start) + 0.25) == PHASE_NAMES[codes[i]]
+    assert cached.phase_at(-5.0) == "Intro"
+    assert cached.phase_at(10_000.0) == "Outro"
+
+
+def test_load_returns_none_for_missing_or_foreign_files(tmp_path):
+    assert Envelope.load(str(tmp_path), "missingmiss") is None
+
+    bad = envelope_path(str(tmp_path), "badbadbadba")
+    with open(bad, "wb") as f:
+        f.write(HEADER.pack(b"NOPE", VERSION, 500, 0, 0))
+    assert Envelope.load(str(tmp_path), "badbadbadba") is None
+
+    newer = envelope_path(str(tmp_path), "newernewern")
+    with open(newer, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION + 1, 500, 0, 0))
+    assert Envelope.load(str(tmp_path), "newernewern") is None
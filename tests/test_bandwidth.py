@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from spci.bandwidth import BandwidthEstimator
+
+
+@pytest.fixture
+def estimator(tmp_path):
+    return BandwidthEstimator(str(tmp_path / "bandwidth.json"))
+
+
+def test_unmeasured_link_takes_the_best_audio(estimator):
+    assert estimator.select_format() == ("bestaudio/best", "auto, unmeasured")
+
+
+def test_first_sample_is_taken_as_is(estimator):
+    estimator.record(1_000_000, 2.0)  # 8000 kbit in 2 s
+    assert estimator.kbps == pytest.approx(4000)
+    assert estimator.samples == 1
+
+
+def test_later_samples_are_smoothed(estimator):
+    estimator.record(1_000_000, 2.0)   # 4000 kbps
+    estimator.record(250_000, 2.0)     # 1000 kbps
+    expected = BandwidthEstimator.ALPHA * 1000 + (1 - BandwidthEstimator.ALPHA) * 4000
+    assert estimator.kbps == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("num_bytes, seconds", [(0, 1.0), (None, 1.0), (1000, 0), (1000, None), (1000, -1.0)])
+def test_empty_or_timeless_transfers_are_ignored(estimator, num_bytes, seconds):
+    estimator.record(num_bytes, seconds)
+    assert estimator.samples == 0 and estimator.kbps == 0
+
+
+def test_auto_caps_at_half_the_measured_link(estimator):
+    estimator.record(40_000, 1.0)  # 320 kbps
+    fmt, mode = estimator.select_format("auto")
+    assert fmt == "bestaudio[abr<=160]/worstaudio/best"
+    assert mode == "auto, link ~320 kbps"
+
+
+@pytest.mark.parametrize("quality, expected", [
+    ("low", "bestaudio[abr<=64]/worstaudio/best"),
+    ("medium", "bestaudio[abr<=128]/worstaudio/best"),
+    ("high", "bestaudio/best"),
+    ("96", "bestaudio[abr<=96]/worstaudio/best"),
+])
+def test_presets_and_manual_caps_ignore_the_measurement(estimator, quality, expected):
+    estimator.record(10_000, 1.0)  # 80 kbps would cap auto at 40
+    assert estimator.select_format(quality)[0] == expected
+
+
+def test_measurement_persists_between_runs(tmp_path):
+    path = str(tmp_path / "bandwidth.json")
+    BandwidthEstimator(path).record(1_000_000, 2.0)
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["samples"] == 1
+    reloaded = BandwidthEstimator(path)
+    assert reloaded.kbps == pytest.approx(4000) and reloaded.samples == 1
+
+
+def test_corrupt_state_file_starts_fresh(tmp_path):
+    path = tmp_path / "bandwidth.json"
+    path.write_text("{not json", encoding="utf-8")
+    assert BandwidthEstimator(str(path)).samples == 0
+
+
+def test_progress_hook_records_finished_downloads_only(estimator):
+    estimator.progress_hook({"status": "downloading", "downloaded_bytes": 500, "elapsed": 1.0})
+    assert estimator.samples == 0
+    estimator.progress_hook({"status": "finished", "total_bytes": 125_000, "elapsed": 1.0})
+    assert estimator.kbps == pytest.approx(1000)
@@ -0,0 +1,157 @@
+import random
+
+from spci.playqueue import PlayQueue
+
+
+def make_queue(*items):
+    return PlayQueue(items or "ABCDE")
+
+
+def order(queue):
+    return [item for _, item in queue]
+
+
+def test_append_returns_handles_and_keeps_order():
+    queue = PlayQueue()
+    handles = [queue.append(x) for x in "ABC"]
+    assert handles == [1, 2, 3]
+    assert order(queue) == ["A", "B", "C"]
+    assert len(queue) == 3
+
+
+def test_advance_walks_the_queue_and_ends_with_none():
+    queue = make_queue("A", "B")
+    assert queue.advance() == "A"
+    assert queue.advance() == "B"
+    assert queue.advance() is None
+
+
+def test_append_after_queue_ran_out_resumes_there():
+    queue = make_queue("A")
+    queue.advance()
+    assert queue.advance() is None
+    queue.append("B")
+    assert queue.upcoming() == ["B"]
+    assert queue.advance() == "B"
+
+
+def test_remove_upcoming_track():
+    queue = make_queue()
+    queue.advance()
+    assert queue.remove(3)
+    assert order(queue) == ["A", "B", "D", "E"]
+    assert queue.upcoming() == ["B", "D", "E"]
+    assert not queue.remove(3)
+
+
+def test_remove_current_track_continues_with_its_successor():
+    queue = make_queue()
+    queue.advance()
+    queue.advance()  # B
+    queue.remove(2)
+    assert queue.current is None
+    assert queue.upcoming() == ["C", "D", "E"]
+    assert queue.advance() == "C"
+
+
+def test_remove_head_and_tail():
+    queue = make_queue()
+    queue.remove(1)
+    queue.remove(5)
+    assert order(queue) == ["B", "C", "D"]
+    queue.append("F")
+    assert order(queue) == ["B", "C", "D", "F"]
+
+
+def test_jump_moves_current_and_records_history():
+    queue = make_queue()
+    queue.advance()
+    assert queue.jump(4) == "D"
+    assert queue.upcoming() == ["E"]
+    assert queue.previous() == "A"
+    assert queue.jump(99) is None
+
+
+def test_previous_follows_play_history_not_list_order():
+    queue = make_queue()
+    queue.advance()   # A
+    queue.jump(5)     # E
+    queue.jump(3)     # C
+    assert queue.previous() == "E"
+    assert queue.previous() == "A"
+    assert queue.previous() is None
+
+
+def test_previous_skips_removed_tracks():
+    queue = make_queue()
+    queue.advance()
+    queue.advance()
+    queue.advance()   # C, history A, B
+    queue.remove(2)
+    assert queue.previous() == "A"
+
+
+def test_shuffle_only_touches_upcoming_tracks():
+    random.seed(1)
+    queue = make_queue()
+    queue.advance()
+    queue.advance()   # B
+    queue.shuffle()
+    assert queue.shuffled
+    assert order(queue)[:2] == ["A", "B"]
+    assert sorted(queue.upcoming()) == ["C", "D", "E"]
+    assert queue.current.item == "B"
+
+
+def test_unshuffle_restores_order_of_upcoming_tracks():
+    random.seed(3)
+    queue = make_queue()
+    queue.advance()   # A
+    queue.shuffle()
+    played = queue.advance()
+    queue.unshuffle()
+    assert not queue.shuffled
+    assert queue.current.item == played
+    assert queue.upcoming() == [x for x in "BCDE" if x != played]
+    assert sorted(order(queue)) == list("ABCDE")
+
+
+def test_unshuffle_keeps_every_track_reachable():
+    # Regression: play A, shuffle, play E, unshuffle used to leave nothing upcoming
+    queue = make_queue()
+    queue.advance()
+    queue.shuffle()
+    while queue.current.item != "E":
+        queue.advance()
+    after_e = sorted(queue.upcoming(limit=10))
+    queue.unshuffle()
+    assert queue.current.item == "E"
+    assert queue.upcoming(limit=10) == after_e
+    assert sorted(order(queue)) == list("ABCDE")
+
+
+def test_unshuffle_puts_tracks_added_while_shuffled_last():
+    random.seed(0)
+    queue = make_queue()
+    queue.advance()
+    queue.shuffle()
+    queue.append("F")
+    queue.append("G")
+    queue.unshuffle()
+    assert queue.upcoming(limit=10) == ["B", "C", "D", "E", "F", "G"]
+
+
+def test_unshuffle_before_playback_restores_full_order():
+    queue = make_queue()
+    queue.shuffle()
+    queue.unshuffle()
+    assert order(queue) == list("ABCDE")
+    assert queue.upcoming(limit=10) == list("ABCDE")
+
+
+def test_rewind_starts_over_from_the_head():
+    queue = make_queue("A", "B")
+    queue.advance()
+    queue.advance()
+    queue.rewind()
+    assert queue.advance() == "A"
@@ -0,0 +1,52 @@
+import json
+import multiprocessing
+
+from tinydb import Query
+
+from spci.storage import SharedTinyDB, FileLock, append_line
+
+PROCS = 6
+ROUNDS = 40
+
+
+def hammer(db_path, log_path, proc):
+    """One writer process: inserts, upserts and removes while the others do the same."""
+    db = SharedTinyDB(db_path)
+    items, counters = db.table("items"), db.table("counters")
+    Item, Counter = Query(), Query()
+    lock = FileLock(log_path)
+    for n in range(ROUNDS):
+        items.insert({"proc": proc, "n": n})
+        counters.upsert({"proc": proc, "count": n + 1}, Counter.proc == proc)
+        if n % 2:
+            items.remove((Item.proc == proc) & (Item.n == n))
+        append_line(log_path, f"{proc} {n}\n", lock)
+
+
+def test_concurrent_writers_lose_nothing(tmp_path):
+    db_path = str(tmp_path / "favorites.json")
+    log_path = str(tmp_path / "play_history.txt")
+
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=hammer, args=(db_path, log_path, p)) for p in range(PROCS)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(timeout=120)
+        assert proc.exitcode == 0
+
+    with open(db_path, encoding="utf-8") as f:
+        data = json.load(f)  # Never a half-written file
+
+    items = list(data["items"].values())
+    assert len(data["items"]) == PROCS * ROUNDS // 2  # Unique doc ids, nothing overwritten
+    assert sorted((d["proc"], d["n"]) for d in items) == [
+        (p, n) for p in range(PROCS) for n in range(0, ROUNDS, 2)
+    ]
+
+    counters = sorted(data["counters"].values(), key=lambda d: d["proc"])
+    assert counters == [{"proc": p, "count": ROUNDS} for p in range(PROCS)]
+
+    with open(log_path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert sorted(lines) == sorted(f"{p} {n}" for p in range(PROCS) for n in range(ROUNDS))